@@ -3,20 +3,148 @@ from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
 from bson.objectid import ObjectId
 from functools import wraps
+import click
+import assets
+import compression
 import database as dbase
+import indexes
+import images
+import session_store
+import os
 
 from routes.cliente import bp_cliente
 from routes.empleado import bp_empleado
 from routes.admin import bp_admin
 from routes.auth import auth_bp
-db = dbase.dbConnection()
+from routes.services import cached_fragment
+db = dbase.get_db()
 app = Flask(__name__)
 app.secret_key = "clave_super_segura"
+# Sesión en el servidor: la cookie solo lleva un id opaco (STORE_BACKEND=mongo|memory)
+app.session_interface = session_store.session_interface
+# {{ producto.image_variants|srcset('img/products') }} -> "url 320w, url 640w, ..."
+app.add_template_filter(images.srcset, "srcset")
+# Estáticos con huella: {{ asset_url('css/layout.css') }} y caché inmutable
+app.add_template_global(assets.asset_url, "asset_url")
+app.add_template_global(assets.css_links, "css_links")
+# {% call cached_fragment('cliente/productos-grid') %}...{% endcall %}
+app.add_template_global(cached_fragment, "cached_fragment")
+app.view_functions["static"] = assets.serve_static
 
 app.register_blueprint(auth_bp)
 app.register_blueprint(bp_cliente)
 app.register_blueprint(bp_empleado)
 app.register_blueprint(bp_admin)
 
+# Compresión gzip/brotli de HTML y JSON para todos los blueprints
+compression.init_compression(app)
+
+# Crear índices al arrancar: create_index es idempotente y el registro depende
+# de los únicos de users. MONGO_ENSURE_INDEXES=0 lo desactiva (p. ej. si se
+# gestionan aparte con `flask ensure-indexes`).
+if os.environ.get("MONGO_ENSURE_INDEXES", "1") == "1":
+    for error in indexes.ensure_indexes():
+        print("Error creando índice:", error)
+
+
+@app.cli.command("ensure-indexes")
+def ensure_indexes():
+    """Crea (de forma idempotente) todos los índices de la aplicación."""
+    errores = indexes.ensure_indexes()
+    for error in errores:
+        print("Error creando índice:", error)
+    print("Índices verificados" if not errores else f"{len(errores)} índices con error")
+
+
+@app.cli.command("check-indexes")
+def check_indexes():
+    """Ejecuta explain() sobre las consultas de las rutas y avisa si alguna hace COLLSCAN u ordena en memoria."""
+    fallos = 0
+    for descripcion, etapas, problema in indexes.check_query_plans():
+        print(f"{problema or 'OK':9} {descripcion}: {' > '.join(etapas)}")
+        fallos += problema is not None
+    if fallos:
+        raise SystemExit(1)
+
+
+@app.cli.command("rebuild-sales")
+def rebuild_sales():
+    """Recalcula sales_daily y order_counters desde todos los pedidos."""
+    from routes.services import rebuild_sales_daily
+    total = rebuild_sales_daily()
+    print(f"sales_daily reconstruida: {total} documentos (order_counters actualizada)")
+
+
+@app.cli.command("backfill-order-dates")
+def backfill_order_dates():
+    """Añade 'date' a los pedidos del carrito antiguos que solo guardan 'fecha'."""
+    from routes.services import backfill_order_dates
+    total = backfill_order_dates()
+    print(f"{total} pedidos actualizados (ejecuta rebuild-sales para recalcular los totales por día)")
+
+
+@app.cli.command("build-assets")
+def build_assets():
+    """Copia css/js/img y los bundles de CSS a static/dist con huella, precomprime y escribe el manifiesto."""
+    manifest = assets.build_assets(app.static_folder)
+    print(f"{len(manifest)} archivos en static/{assets.DIST_DIR}/{assets.MANIFEST_NAME}")
+    if assets.brotli is None:
+        print("brotli no está instalado: solo se generaron variantes .gz (pip install brotli)")
+
+
+# (rol, url) de las páginas y endpoints JSON más pesados
+BENCH_URLS = [
+    ("cliente", "/cliente/"),
+    ("cliente", "/cliente/productos"),
+    ("empleado", "/empleado/pedidos"),
+    ("empleado", "/empleado/clientes/buscar?q=a"),
+    ("admin", "/admin/pedidos"),
+    ("admin", "/admin/inventario"),
+    ("admin", "/admin/cache/stats"),
+]
+
+
+@app.cli.command("bench-compression")
+@click.option("--repeats", default=20, help="Compresiones por respuesta y nivel.")
+def bench_compression(repeats):
+    """Bytes ahorrados y CPU por respuesta al comprimir las páginas de BENCH_URLS."""
+    client = app.test_client()
+    payloads = {}
+    for role, url in BENCH_URLS:
+        user = dbase.get_db().users.find_one({"role": role}, {"_id": 1})
+        if not user:
+            print(f"sin usuarios con rol {role}: se omite {url}")
+            continue
+        with client.session_transaction() as s:
+            s["user_id"], s["role"] = str(user["_id"]), role
+        resp = client.get(url, headers={"Accept-Encoding": "identity"})
+        if resp.status_code == 200:
+            payloads[url] = resp.get_data()
+        else:
+            print(f"{url}: HTTP {resp.status_code}, se omite")
+
+    print(f"{'url':34} {'cod':4} {'niv':>3} {'bytes':>9} {'comprimido':>10} {'ahorro':>7} {'ms CPU':>7}")
+    for url, encoding, level, size, comprimido, ms in compression.benchmark(payloads, repeats):
+        ahorro = 100 * (1 - comprimido / size) if size else 0
+        print(f"{url:34} {encoding:4} {level:>3} {size:>9} {comprimido:>10} {ahorro:>6.1f}% {ms:>7.2f}")
+    if compression.brotli is None:
+        print("brotli no está instalado: solo se midió gzip (pip install brotli)")
+
+
+@app.cli.command("reprocess-images")
+def reprocess_images():
+    """Renombra por contenido y genera las variantes WebP de las imágenes ya subidas."""
+    from routes.services import reprocess_stored_images
+    if images.Image is None:
+        print("Pillow no está instalado: solo se renombrarán los archivos (pip install Pillow)")
+    for collection, folder, field in (
+        ("products", images.PRODUCT_IMAGE_FOLDER, "image"),
+        ("categories", images.CATEGORY_IMAGE_FOLDER, "icon"),
+    ):
+        procesadas, faltantes = reprocess_stored_images(collection, folder, field)
+        print(f"{collection}: {procesadas} imágenes procesadas")
+        for filename in faltantes:
+            print(f"  falta el archivo {filename}")
+
 if __name__ == '__main__':
     app.run(debug=True, port=4000)
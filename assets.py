@@ -0,0 +1,340 @@
+from flask import current_app, request, send_from_directory, url_for
+from markupsafe import Markup, escape
+from werkzeug.utils import safe_join
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import threading
+import time
+
+try:
+    import brotli
+except ImportError:  # brotli es opcional: sin él solo se genera .gz
+    brotli = None
+
+# ============================================================
+#          ARCHIVOS ESTÁTICOS CON HUELLA (FINGERPRINT)
+# ============================================================
+# `flask build-assets` copia css/, js/ e img/ a static/dist/ con el hash del
+# contenido en el nombre (css/layout.css -> dist/css/layout.1a2b3c4d.css),
+# guarda junto a los archivos de texto sus versiones .gz y .br y escribe
+# static/dist/manifest.json. asset_url() resuelve los nombres con el
+# manifiesto (sin manifiesto devuelve la URL normal) y serve_static()
+# sirve esos archivos con caché inmutable y la variante comprimida que
+# acepte el navegador. Además arma un CSS minificado por bundle
+# (CSS_BUNDLES) que las plantillas incluyen con css_links().
+
+ASSET_DIRS = ('css', 'js', 'img')
+# Carpetas de subidas: ya tienen nombre por contenido (images.py)
+UPLOAD_DIRS = ('img/products', 'img/categories')
+DIST_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+ASSETS_MANIFEST_CHECK = float(os.environ.get('ASSETS_MANIFEST_CHECK', 10))
+
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.txt', '.map')
+PRECOMPRESSED = (('br', '.br'), ('gzip', '.gz'))
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+
+_HASHED_UPLOAD_RE = re.compile(r'-[0-9a-f]{12}(-\d+w)?\.[A-Za-z0-9]+$')
+
+# Con ASSETS_DEBUG=1 (o app.debug) css_links() enlaza los archivos originales
+ASSETS_DEBUG = os.environ.get('ASSETS_DEBUG', '0') == '1'
+
+
+# ---------------------- BUNDLES DE CSS ----------------------
+# Un bundle por layout con sus hojas en el mismo orden en que se cargaban.
+# Las páginas que agregan su propia hoja tienen un bundle "<layout>/<página>"
+# (layout + página): varias hojas de página repiten selectores (.precio,
+# :root...) y juntarlas todas cambiaría el resultado de la cascada.
+# Las hojas no deben usar url() relativas: el bundle vive en otra carpeta.
+CSS_BUNDLES = {
+    'base': ['css/layout.css'],
+    'auth': ['css/auth.css'],
+    'admin': [
+        'css/layout.css',
+        'css/layout_admin.css',
+        'css/admin/categorias.css',
+        'css/admin/dashboard.css',
+        'css/admin/empleados.css',
+        'css/admin/inventario.css',
+        'css/admin/clientes.css',
+        'css/admin/pedidos.css',
+        'css/admin/productos.css',
+        'css/global_nav.css',
+    ],
+    'cliente': ['css/layout.css', 'css/global_nav.css', 'css/layout_cliente.css'],
+    'empleado': [
+        'css/layout.css',
+        'css/global_nav.css',
+        'css/layout_empleado.css',
+        'css/empleado/dashboard.css',
+    ],
+}
+
+
+def _page_bundles(layout, pages):
+    return {f"{layout}/{page}": CSS_BUNDLES[layout] + [f"css/{layout}/{page}.css"] for page in pages}
+
+
+CSS_BUNDLES.update(_page_bundles(
+    'cliente', ('carrito', 'categorias', 'dashboard', 'detalle_producto', 'mis_pedidos', 'productos')
+))
+CSS_BUNDLES.update(_page_bundles(
+    'empleado', ('crear_pedido', 'empleado_clientes', 'inventario', 'pedidos', 'productos')
+))
+
+
+def bundle_path(name):
+    return f"css/bundles/{name}.css"
+
+
+_CSS_TOKEN_RE = re.compile(r'/\*.*?\*/|"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'', re.S)
+_CSS_SPACE_RE = re.compile(r'\s+')
+_CSS_PUNCT_RE = re.compile(r'\s*([{};,>])\s*')
+
+
+def _minify_segment(text):
+    text = _CSS_SPACE_RE.sub(' ', text)
+    text = _CSS_PUNCT_RE.sub(r'\1', text)
+    return text.replace(';}', '}')
+
+
+def minify_css(css):
+    """
+    Quita comentarios y espacios sobrantes sin tocar las cadenas. Conserva
+    los espacios alrededor de + y - (calc()) y antes de ':' (selectores).
+    """
+    partes, inicio = [], 0
+    for match in _CSS_TOKEN_RE.finditer(css):
+        partes.append(_minify_segment(css[inicio:match.start()]))
+        if not match.group().startswith('/*'):
+            partes.append(match.group())
+        inicio = match.end()
+    partes.append(_minify_segment(css[inicio:]))
+    return ''.join(partes).strip()
+
+
+def build_bundle(static_folder, name):
+    """Contenido minificado de un bundle (sus hojas concatenadas en orden)."""
+    hojas = []
+    for src in CSS_BUNDLES[name]:
+        with open(os.path.join(static_folder, src), encoding='utf-8') as f:
+            hojas.append(minify_css(f.read()))
+    return '\n'.join(hojas).encode('utf-8')
+
+
+# ---------------------- CONSTRUCCIÓN ----------------------
+def fingerprint(rel_path, data):
+    """'css/layout.css' + contenido -> 'css/layout.<hash8>.css'."""
+    stem, ext = os.path.splitext(rel_path)
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:8]}{ext}"
+
+
+def _write_atomic(path, data):
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def write_asset(dist, hashed, data):
+    """Escribe dist/hashed (y sus .gz/.br si es texto) si aún no existe."""
+    path = os.path.join(dist, hashed)
+    if os.path.exists(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    _write_atomic(path, data)
+    if not hashed.endswith(COMPRESSIBLE):
+        return
+    variantes = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variantes['.br'] = brotli.compress(data, quality=11)
+    for ext, comprimido in variantes.items():
+        if len(comprimido) < len(data):
+            _write_atomic(path + ext, comprimido)
+
+
+def _iter_sources(static_folder):
+    for carpeta in ASSET_DIRS:
+        for root, dirs, files in os.walk(os.path.join(static_folder, carpeta)):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                rel = os.path.relpath(path, static_folder).replace(os.sep, '/')
+                if rel.startswith(tuple(d + '/' for d in UPLOAD_DIRS)):
+                    continue
+                yield rel, path
+
+
+def build_assets(static_folder):
+    """
+    Genera static/dist y su manifiesto. Los archivos de compilaciones
+    anteriores se conservan, así las páginas ya cacheadas siguen funcionando.
+    Devuelve el manifiesto {ruta original: ruta con huella}.
+    """
+    dist = os.path.join(static_folder, DIST_DIR)
+    manifest = {}
+    for rel, path in _iter_sources(static_folder):
+        with open(path, 'rb') as f:
+            data = f.read()
+        hashed = fingerprint(rel, data)
+        write_asset(dist, hashed, data)
+        manifest[rel] = f"{DIST_DIR}/{hashed}"
+
+    for name in CSS_BUNDLES:
+        data = build_bundle(static_folder, name)
+        hashed = fingerprint(bundle_path(name), data)
+        write_asset(dist, hashed, data)
+        manifest[bundle_path(name)] = f"{DIST_DIR}/{hashed}"
+
+    os.makedirs(dist, exist_ok=True)
+    _write_atomic(
+        os.path.join(dist, MANIFEST_NAME),
+        json.dumps(manifest, indent=1, sort_keys=True).encode('utf-8')
+    )
+    reset_manifest()
+    return manifest
+
+
+# ---------------------- MANIFIESTO ----------------------
+_manifest = {"data": {}, "mtime": None, "checked_at": 0.0}
+_manifest_lock = threading.Lock()
+
+
+def reset_manifest():
+    with _manifest_lock:
+        _manifest.update(data={}, mtime=None, checked_at=0.0)
+
+
+def get_manifest():
+    """Manifiesto actual; se relee si el archivo cambió (como mucho cada ASSETS_MANIFEST_CHECK s)."""
+    ahora = time.monotonic()
+    if ahora - _manifest["checked_at"] < ASSETS_MANIFEST_CHECK:
+        return _manifest["data"]
+    with _manifest_lock:
+        _manifest["checked_at"] = ahora
+        path = os.path.join(current_app.static_folder, DIST_DIR, MANIFEST_NAME)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            _manifest.update(data={}, mtime=None)
+            return _manifest["data"]
+        if mtime != _manifest["mtime"]:
+            with open(path, encoding='utf-8') as f:
+                _manifest.update(data=json.load(f), mtime=mtime)
+        return _manifest["data"]
+
+
+def manifest_version():
+    """mtime del manifiesto cargado (None sin manifiesto); cambia con cada build."""
+    get_manifest()
+    return _manifest["mtime"]
+
+
+def asset_url(filename):
+    """Como url_for('static', filename=...) pero con el nombre con huella si existe."""
+    return url_for('static', filename=get_manifest().get(filename, filename))
+
+
+def css_links(name):
+    """
+    <link> del bundle 'name' con huella. En modo debug, los <link> de sus
+    hojas originales tal como están en static/ (no las copias de dist, que
+    pueden estar desactualizadas); si el bundle aún no se compiló, los de
+    sus hojas con huella.
+    """
+    manifest = get_manifest()
+    if ASSETS_DEBUG or current_app.debug:
+        urls = [url_for('static', filename=src) for src in CSS_BUNDLES[name]]
+    elif bundle_path(name) not in manifest:
+        urls = [asset_url(src) for src in CSS_BUNDLES[name]]
+    else:
+        urls = [url_for('static', filename=manifest[bundle_path(name)])]
+    return Markup('\n'.join(f'<link rel="stylesheet" href="{escape(u)}">' for u in urls))
+
+
+# ---------------------- LISTADOS DE CARPETAS ----------------------
+class StaticDirIndex:
+    """
+    Lista cacheada de los archivos de una carpeta de static (p. ej. los
+    banners del hero) como rutas relativas ordenadas ('img/hero/a.jpg').
+    Con manifiesto se toma de él; sin manifiesto la carpeta se relee solo
+    cuando cambia su mtime, que se revisa como mucho cada check_every s.
+    """
+
+    def __init__(self, rel_dir, extensions, check_every=ASSETS_MANIFEST_CHECK):
+        self.rel_dir = rel_dir.strip('/')
+        self.extensions = tuple(ext.lower() for ext in extensions)
+        self.check_every = check_every
+        self._files = ()
+        self._source = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def _matches(self, name):
+        return not name.startswith('.') and name.lower().endswith(self.extensions)
+
+    def _list(self, manifest, folder):
+        prefix = self.rel_dir + '/'
+        if manifest:
+            nombres = (rel[len(prefix):] for rel in manifest if rel.startswith(prefix))
+            nombres = [n for n in nombres if '/' not in n]
+        else:
+            with os.scandir(folder) as entries:
+                nombres = [e.name for e in entries if e.is_file()]
+        return tuple(sorted(prefix + n for n in nombres if self._matches(n)))
+
+    def files(self):
+        ahora = time.monotonic()
+        if self._checked_at is not None and ahora - self._checked_at < self.check_every:
+            return self._files
+        with self._lock:
+            self._checked_at = ahora
+            manifest = get_manifest()
+            folder = os.path.join(current_app.static_folder, self.rel_dir)
+            if manifest:
+                source = ('manifest', _manifest['mtime'])
+            else:
+                try:
+                    source = ('dir', os.stat(folder).st_mtime_ns)
+                except OSError:
+                    source = None
+            if source != self._source:
+                self._files = self._list(manifest, folder) if source else ()
+                self._source = source
+            return self._files
+
+
+# ---------------------- SERVIDOR ----------------------
+def is_fingerprinted(filename):
+    return filename.startswith(DIST_DIR + '/') or bool(_HASHED_UPLOAD_RE.search(filename))
+
+
+def serve_static(filename):
+    """
+    Reemplaza la vista 'static' de Flask: caché inmutable para archivos con
+    huella y, si el navegador lo acepta, la variante .br/.gz precomprimida.
+    """
+    static_folder = current_app.static_folder
+    servido, encoding = filename, None
+    if filename.endswith(COMPRESSIBLE):
+        for enc, ext in PRECOMPRESSED:
+            if request.accept_encodings[enc]:
+                path = safe_join(static_folder, filename + ext)
+                if path and os.path.isfile(path):
+                    servido, encoding = filename + ext, enc
+                    break
+
+    response = send_from_directory(
+        static_folder, servido, mimetype=mimetypes.guess_type(filename)[0]
+    )
+    if filename.endswith(COMPRESSIBLE):
+        response.vary.add('Accept-Encoding')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Cache-Control'] = IMMUTABLE if is_fingerprinted(filename) else REVALIDATE
+    return response
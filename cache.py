@@ -0,0 +1,110 @@
+from collections import OrderedDict
+import threading
+import time
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Caché en memoria del proceso con expiración (TTL) y expulsión LRU.
+    Es segura entre hilos y lleva contadores de aciertos y fallos.
+    """
+
+    def __init__(self, maxsize=1024, ttl=30, name="cache"):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.name = name
+        self._data = OrderedDict()  # clave -> (expira_en, valor)
+        self._lock = threading.Lock()
+        self._loading = {}  # clave -> lock de la carga en curso (single-flight)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING or item[0] <= now:
+                if item is not _MISSING:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def _peek(self, key):
+        """Como get() pero sin contar aciertos ni fallos."""
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING or item[0] <= time.monotonic():
+                return _MISSING
+            return item[1]
+
+    def get_or_load(self, key, loader, ttl=None, single_flight=False):
+        """
+        Devuelve el valor en caché o lo calcula con loader() y lo guarda.
+        Con single_flight, si varios hilos piden la misma clave vencida solo
+        uno ejecuta loader(); los demás esperan y reciben ese resultado.
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        if not single_flight:
+            value = loader()
+            self.set(key, value, ttl)
+            return value
+
+        with self._lock:
+            lock = self._loading.setdefault(key, threading.Lock())
+        try:
+            with lock:
+                value = self._peek(key)
+                if value is _MISSING:
+                    value = loader()
+                    self.set(key, value, ttl)
+                return value
+        finally:
+            with self._lock:
+                if self._loading.get(key) is lock:
+                    del self._loading[key]
+
+    def invalidate(self, key):
+        with self._lock:
+            if self._data.pop(key, _MISSING) is not _MISSING:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._data)
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "name": self.name,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations
+            }
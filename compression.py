@@ -0,0 +1,93 @@
+from flask import request
+import gzip
+import os
+import time
+
+try:
+    import brotli
+except ImportError:  # brotli es opcional: sin él solo se usa gzip
+    brotli = None
+
+# ============================================================
+#          COMPRESIÓN DE RESPUESTAS (HTML / JSON)
+# ============================================================
+# after_request a nivel de la aplicación, así cubre todos los blueprints.
+# Solo comprime respuestas con cuerpo en memoria (no streaming ni archivos,
+# que ya tienen sus variantes .gz/.br precomprimidas), de un tipo de la
+# lista y de al menos COMPRESS_MIN_SIZE bytes.
+
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 500))
+COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', 6))            # gzip 1-9
+COMPRESS_BR_QUALITY = int(os.environ.get('COMPRESS_BR_QUALITY', 4))  # brotli 0-11
+COMPRESS_MIMETYPES = tuple(os.environ.get(
+    'COMPRESS_MIMETYPES',
+    'text/html,text/css,text/plain,text/csv,application/json,application/javascript,image/svg+xml'
+).split(','))
+
+
+def available_encodings():
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def compress(data, encoding, level=None):
+    """Comprime bytes con 'gzip' o 'br' (level: nivel gzip o calidad brotli)."""
+    if encoding == 'br':
+        return brotli.compress(data, quality=COMPRESS_BR_QUALITY if level is None else level)
+    return gzip.compress(data, compresslevel=COMPRESS_LEVEL if level is None else level, mtime=0)
+
+
+def _compressible(response):
+    return (
+        200 <= response.status_code < 300
+        and response.status_code != 204
+        and not response.direct_passthrough
+        and not response.is_streamed
+        and 'Content-Encoding' not in response.headers
+        and response.mimetype in COMPRESS_MIMETYPES
+    )
+
+
+def compress_response(response):
+    if request.method == 'HEAD' or not _compressible(response):
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = request.accept_encodings.best_match(available_encodings())
+    if encoding is None:
+        return response
+
+    response.set_data(compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    # El ETag identifica la representación: la comprimida lleva su propio sufijo
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f"{etag}-{encoding}", weak=weak)
+    return response
+
+
+def init_compression(app):
+    app.after_request(compress_response)
+
+
+# ---------------------- BENCHMARK ----------------------
+def benchmark(payloads, repeats=20):
+    """
+    Comprime cada payload {nombre: bytes} con varios niveles y mide el CPU.
+    Devuelve filas (nombre, codificación, nivel, bytes, bytes_comprimidos,
+    ms_cpu_por_respuesta).
+    """
+    niveles = [('gzip', 1), ('gzip', COMPRESS_LEVEL), ('gzip', 9)]
+    if brotli is not None:
+        niveles += [('br', COMPRESS_BR_QUALITY), ('br', 11)]
+    filas = []
+    for nombre, data in payloads.items():
+        for encoding, level in dict.fromkeys(niveles):
+            inicio = time.process_time()
+            for _ in range(repeats):
+                comprimido = compress(data, encoding, level)
+            ms = (time.process_time() - inicio) * 1000 / repeats
+            filas.append((nombre, encoding, level, len(data), len(comprimido), ms))
+    return filas
@@ -0,0 +1,60 @@
+from bson.objectid import ObjectId
+from datetime import datetime
+import csv
+import io
+import json
+
+# ============================================================
+#          EXPORTACIONES EN STREAMING (CSV / NDJSON)
+# ============================================================
+# Las filas llegan de un generador que recorre un cursor de Mongo por
+# lotes y se escriben en trozos de CHUNK_ROWS filas, así que la memoria
+# usada no depende del tamaño de la exportación.
+
+EXPORT_FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson; charset=utf-8",
+}
+CHUNK_ROWS = 500
+
+
+def _valor(v):
+    if isinstance(v, ObjectId):
+        return str(v)
+    if isinstance(v, datetime):
+        return v.isoformat()
+    return v
+
+
+def stream_csv(rows, fields, chunk_rows=CHUNK_ROWS):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    pendientes = 0
+    for row in rows:
+        writer.writerow([_valor(row.get(f)) for f in fields])
+        pendientes += 1
+        if pendientes >= chunk_rows:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+            pendientes = 0
+    yield buffer.getvalue()
+
+
+def stream_ndjson(rows, fields, chunk_rows=CHUNK_ROWS):
+    lineas = []
+    for row in rows:
+        lineas.append(json.dumps({f: _valor(row.get(f)) for f in fields}, ensure_ascii=False))
+        if len(lineas) >= chunk_rows:
+            yield "\n".join(lineas) + "\n"
+            lineas = []
+    if lineas:
+        yield "\n".join(lineas) + "\n"
+
+
+def stream_export(rows, fields, formato="csv"):
+    """Generador de texto en el formato pedido ('csv' o 'ndjson')."""
+    if formato == "ndjson":
+        return stream_ndjson(rows, fields)
+    return stream_csv(rows, fields)
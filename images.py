@@ -0,0 +1,134 @@
+from concurrent.futures import ThreadPoolExecutor
+from flask import url_for
+from werkzeug.utils import secure_filename
+import hashlib
+import os
+import threading
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow es opcional: sin él se guarda solo el original
+    Image = None
+
+# ============================================================
+#          PROCESAMIENTO DE IMÁGENES SUBIDAS
+# ============================================================
+# Cada subida se guarda con un nombre que incluye el hash de su contenido
+# ("torta-3f2a9c1b7d4e.jpg") y, en un hilo aparte, se generan variantes
+# WebP de varios anchos ("torta-3f2a9c1b7d4e-320w.webp") para srcset.
+# Como el nombre cambia con el contenido, los archivos se pueden cachear
+# indefinidamente en el navegador.
+
+_STATIC = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+PRODUCT_IMAGE_FOLDER = os.path.join(_STATIC, 'img', 'products')
+CATEGORY_IMAGE_FOLDER = os.path.join(_STATIC, 'img', 'categories')
+
+IMAGE_WIDTHS = tuple(int(w) for w in os.environ.get('IMAGE_WIDTHS', '320,640,1024').split(','))
+IMAGE_WEBP_QUALITY = int(os.environ.get('IMAGE_WEBP_QUALITY', 80))
+IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', 1))
+
+
+def hashed_filename(filename, data):
+    """'Torta Chocolate.JPG' + contenido -> 'Torta_Chocolate-<hash12>.jpg'."""
+    stem, ext = os.path.splitext(secure_filename(filename or '') or 'imagen')
+    digest = hashlib.sha256(data).hexdigest()[:12]
+    if stem.endswith(f"-{digest}"):
+        # Ya tiene el hash de este contenido (p. ej. al reprocesar)
+        return f"{stem}{ext.lower()}"
+    return f"{stem or 'imagen'}-{digest}{ext.lower() or '.jpg'}"
+
+
+def save_upload(file_storage, folder):
+    """Guarda un archivo subido con nombre por contenido. Devuelve el nombre."""
+    data = file_storage.read()
+    filename = hashed_filename(file_storage.filename, data)
+    path = os.path.join(folder, filename)
+    if not os.path.exists(path):
+        os.makedirs(folder, exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+    return filename
+
+
+def build_variants(folder, filename, widths=IMAGE_WIDTHS):
+    """
+    Genera las variantes WebP de una imagen de la carpeta (sin ampliarla).
+    Devuelve {ancho: nombre_de_archivo}; vacío si Pillow no está instalado.
+    """
+    if Image is None:
+        return {}
+    stem = os.path.splitext(filename)[0]
+    variantes = {}
+    with Image.open(os.path.join(folder, filename)) as original:
+        img = ImageOps.exif_transpose(original)
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "transparency" in img.info or "A" in img.getbands() else "RGB")
+        anchos = [w for w in sorted(set(widths)) if w < img.width] or [img.width]
+        for ancho in anchos:
+            nombre = f"{stem}-{ancho}w.webp"
+            destino = os.path.join(folder, nombre)
+            if not os.path.exists(destino):
+                alto = max(1, round(img.height * ancho / img.width))
+                tmp = destino + ".tmp"
+                img.resize((ancho, alto), Image.LANCZOS).save(
+                    tmp, "WEBP", quality=IMAGE_WEBP_QUALITY, method=4
+                )
+                os.replace(tmp, destino)
+            variantes[str(ancho)] = nombre
+    return variantes
+
+
+def _report_error(future):
+    error = future.exception()
+    if error is not None:
+        print("Error procesando imagen:", error)
+
+
+class ImagePipeline:
+    """
+    Cola de procesamiento de imágenes en hilos aparte, para que la petición
+    que sube el archivo responda sin esperar a las variantes. El pool se
+    crea al primer uso en cada proceso (seguro con workers que hacen fork).
+    """
+
+    def __init__(self, workers=IMAGE_WORKERS):
+        self.workers = workers
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        pid = os.getpid()
+        with self._lock:
+            if self._executor is None or self._pid != pid:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="images")
+                self._pid = pid
+            return self._executor
+
+    def submit(self, folder, filename, on_done=None):
+        """Encola las variantes de folder/filename; on_done(variantes) se llama al terminar."""
+        if Image is None:
+            return None
+
+        def tarea():
+            variantes = build_variants(folder, filename)
+            if on_done is not None:
+                on_done(variantes)
+            return variantes
+
+        future = self._get_executor().submit(tarea)
+        future.add_done_callback(_report_error)
+        return future
+
+
+image_pipeline = ImagePipeline()
+
+
+def srcset(variantes, carpeta):
+    """Filtro de plantilla: {ancho: archivo} -> 'url 320w, url 640w'."""
+    if not variantes:
+        return ""
+    return ", ".join(
+        f"{url_for('static', filename=f'{carpeta}/{nombre}')} {ancho}w"
+        for ancho, nombre in sorted(variantes.items(), key=lambda item: int(item[0]))
+    )
@@ -0,0 +1,195 @@
+from pymongo import ASCENDING, DESCENDING
+from bson.objectid import ObjectId
+from datetime import datetime
+from pymongo.errors import OperationFailure
+from database import get_db
+
+# ============================================================
+#                 ÍNDICES DE LA APLICACIÓN
+# ============================================================
+# collection -> lista de (claves, opciones). create_index es idempotente,
+# así que ensure_indexes() se puede ejecutar en cada arranque.
+# Solo las cuentas con contraseña (las que pueden iniciar sesión) deben
+# tener usuario y correo únicos; los clientes presenciales se repiten.
+# Mongo solo usa un índice parcial si la consulta repite su filtro, así que
+# las búsquedas por username/email (login, alta de clientes) usan además
+# username_role/email_role, que no son parciales. Llevan role detrás para
+# no repetir el patrón de claves de los únicos (no se admite antes de 5.0).
+_LOGIN_ACCOUNTS = {"password_hash": {"$exists": True}}
+
+# Colación de los directorios de usuarios: ordena y compara sin distinguir
+# mayúsculas ni tildes (la ñ sigue siendo una letra propia en "es").
+DIRECTORY_COLLATION = {"locale": "es", "strength": 1}
+
+INDEXES = {
+    "users": [
+        ([("username", ASCENDING)], {"name": "username_unique", "unique": True,
+                                     "partialFilterExpression": _LOGIN_ACCOUNTS}),
+        ([("email", ASCENDING)], {"name": "email_unique", "unique": True,
+                                  "partialFilterExpression": _LOGIN_ACCOUNTS}),
+        ([("username", ASCENDING), ("role", ASCENDING)], {"name": "username_role"}),
+        ([("email", ASCENDING), ("role", ASCENDING)], {"name": "email_role"}),
+        ([("role", ASCENDING), ("username", ASCENDING)], {"name": "role_username"}),
+        ([("role", ASCENDING), ("username", ASCENDING), ("_id", ASCENDING)],
+         {"name": "role_username_ci", "collation": DIRECTORY_COLLATION}),
+        ([("role", ASCENDING), ("email", ASCENDING)],
+         {"name": "role_email_ci", "collation": DIRECTORY_COLLATION}),
+    ],
+    "orders": [
+        # Terminan en (date, _id): el orden de los tableros con paginación keyset
+        ([("customer_id", ASCENDING), ("date", DESCENDING), ("_id", DESCENDING)],
+         {"name": "customer_date_id"}),
+        ([("employee_id", ASCENDING), ("date", DESCENDING), ("_id", DESCENDING)],
+         {"name": "employee_date_id"}),
+        ([("created_by", ASCENDING), ("date", DESCENDING), ("_id", DESCENDING)],
+         {"name": "created_by_date_id"}),
+        ([("status", ASCENDING), ("date", DESCENDING), ("_id", DESCENDING)],
+         {"name": "status_date_id"}),
+        ([("date", DESCENDING), ("_id", DESCENDING)], {"name": "date_id"}),
+        ([("fecha", ASCENDING)], {"name": "fecha"}),
+        ([("user_id", ASCENDING), ("date", DESCENDING), ("_id", DESCENDING)],
+         {"name": "user_date_id"}),
+    ],
+    "products": [
+        ([("status", ASCENDING), ("category_id", ASCENDING)], {"name": "status_category"}),
+        ([("category_id", ASCENDING)], {"name": "category"}),
+        ([("inventory.current_quantity", ASCENDING)], {"name": "inventory_quantity"}),
+        ([("quantity", ASCENDING)], {"name": "quantity"}),
+    ],
+    "sessions": [
+        ([("expires_at", ASCENDING)], {"name": "expires_at_ttl", "expireAfterSeconds": 0}),
+    ],
+    "sales_daily": [
+        ([("day", ASCENDING), ("product_id", ASCENDING), ("channel", ASCENDING)],
+         {"name": "day_product_channel", "unique": True}),
+    ],
+    "order_counters": [
+        ([("kind", ASCENDING), ("key", ASCENDING)], {"name": "kind_key", "unique": True}),
+        ([("kind", ASCENDING), ("orders", DESCENDING)], {"name": "kind_orders"}),
+    ],
+}
+
+# Índices sustituidos por otros de INDEXES: ensure_indexes() los borra
+OBSOLETE_INDEXES = {
+    "orders": ["customer_date", "employee_date", "created_by_date", "status_date", "date",
+               "user_id"],
+}
+
+
+def ensure_collection_indexes(name, db=None):
+    """Crea los índices de una colección. Devuelve la lista de errores (vacía si todo bien)."""
+    db = db if db is not None else get_db()
+    errores = []
+    existentes = set(db[name].index_information()) if name in OBSOLETE_INDEXES else set()
+    for obsoleto in OBSOLETE_INDEXES.get(name, []):
+        if obsoleto in existentes:
+            try:
+                db[name].drop_index(obsoleto)
+            except OperationFailure as e:
+                errores.append(f"{name}.{obsoleto}: {e}")
+    for keys, options in INDEXES.get(name, []):
+        try:
+            db[name].create_index(keys, **options)
+        except OperationFailure as e:
+            errores.append(f"{name}.{options.get('name')}: {e}")
+    return errores
+
+
+def ensure_indexes(db=None):
+    """Crea todos los índices declarados en INDEXES."""
+    errores = []
+    for name in INDEXES:
+        errores.extend(ensure_collection_indexes(name, db))
+    return errores
+
+
+# ============================================================
+#          CONSULTAS CALIENTES Y VERIFICACIÓN DE PLANES
+# ============================================================
+# (descripción, colección, filtro, orden[, colación]) de las consultas que hacen
+# las rutas, con la misma forma que tienen en ellas.
+_BOARD_SORT = [("date", -1), ("_id", -1)]
+
+
+def _keyset(base, fecha=datetime(2000, 1, 1), oid=ObjectId()):
+    """Mismo filtro que arma get_orders_page al pedir la página siguiente a un cursor."""
+    ramas = [{"date": {"$lt": fecha}}, {"date": fecha, "_id": {"$lt": oid}}, {"date": None}]
+    return {"$or": [{**base, **rama} for rama in ramas]}
+
+
+def _directorio(q=None, username="x", oid=ObjectId()):
+    """Página N de get_user_directory (services._directory_query + cursor)."""
+    base = {"role": "cliente"}
+    if q:
+        rango = {"$gte": q, "$lt": q + "\uffff"}
+        base["$or"] = [{"username": rango}, {"email": rango}]
+    cursor = {"$or": [{"username": {"$gt": username}}, {"username": username, "_id": {"$gt": oid}}]}
+    return {"$and": [base, cursor]}
+
+
+HOT_QUERIES = [
+    ("auth.login", "users", {"username": "x"}, None),
+    ("auth.register / crear cliente", "users", {"email": "x"}, None),
+    ("directorio clientes página N", "users", _directorio(), [("username", 1), ("_id", 1)],
+     DIRECTORY_COLLATION),
+    ("directorio clientes búsqueda", "users", _directorio(q="ana"), [("username", 1), ("_id", 1)],
+     DIRECTORY_COLLATION),
+    ("sesión (cada petición)", "sessions", {"_id": "x", "expires_at": {"$gt": datetime(2000, 1, 1)}}, None),
+    ("carrito", "carts", {"_id": "x"}, None),
+    ("empleado_panel creados", "orders", {"created_by": ObjectId()}, [("date", -1)]),
+    ("empleado_panel asignados", "orders", {"employee_id": ObjectId()}, [("date", -1)]),
+    ("pedidos por cliente", "orders", {"customer_id": ObjectId()}, [("date", -1)]),
+    ("mis_pedidos", "orders", {"user_id": "x"}, _BOARD_SORT),
+    ("pedidos pendientes", "orders", {"status": "pendiente"}, None),
+    ("pedidos por fecha", "orders", {"date": {"$gte": datetime(2000, 1, 1)}}, None),
+    # Tableros de pedidos: página N de get_orders_page (services._order_keyset_query)
+    ("tablero pedidos página N", "orders", _keyset({}), _BOARD_SORT),
+    ("tablero pedidos por estado página N", "orders", _keyset({"status": "pendiente"}), _BOARD_SORT),
+    ("tablero pedidos por cliente página N", "orders", _keyset({"customer_id": ObjectId()}), _BOARD_SORT),
+    ("tablero pedidos por empleado página N", "orders", _keyset({"employee_id": ObjectId()}), _BOARD_SORT),
+    ("exportar pedidos (carrito)", "orders", {"fecha": {"$gte": "2000-01-01"}}, None),
+    ("catálogo cliente", "products", {"status": "Disponible"}, None),
+    ("productos por categoría", "products", {"status": "Disponible", "category_id": "x"}, None),
+    ("inventario bajo", "products", {"inventory.current_quantity": {"$lt": 5}}, None),
+    ("stock bajo", "products", {"quantity": {"$lt": 5}}, None),
+    ("reportes", "sales_daily", {"day": {"$gte": datetime(2000, 1, 1)}}, None),
+    ("reportes pedidos por estado", "order_counters", {"kind": "status", "key": "pagado"}, None),
+    ("reportes clientes top", "order_counters", {"kind": "customer"}, [("orders", -1)]),
+]
+
+
+def _plan_stages(plan):
+    if not isinstance(plan, dict):
+        return
+    if "stage" in plan:
+        yield plan["stage"]
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from _plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from _plan_stages(child)
+
+
+def explain_query(collection, filtro, sort=None, collation=None, db=None):
+    """Etapas del plan ganador de una consulta (p. ej. ['FETCH', 'IXSCAN'])."""
+    db = db if db is not None else get_db()
+    cmd = {"find": collection, "filter": filtro}
+    if sort:
+        cmd["sort"] = dict(sort)
+    if collation:
+        cmd["collation"] = collation
+    result = db.command("explain", cmd, verbosity="queryPlanner")
+    return list(_plan_stages(result["queryPlanner"]["winningPlan"]))
+
+
+def check_query_plans(db=None):
+    """
+    Ejecuta explain() sobre HOT_QUERIES. Devuelve [(descripción, etapas, problema)],
+    donde problema es 'COLLSCAN', 'SORT' (orden en memoria) o None.
+    """
+    resultados = []
+    for descripcion, collection, filtro, sort, *collation in HOT_QUERIES:
+        etapas = explain_query(collection, filtro, sort, collation[0] if collation else None, db)
+        problema = next((etapa for etapa in ("COLLSCAN", "SORT") if etapa in etapas), None)
+        resultados.append((descripcion, etapas, problema))
+    return resultados
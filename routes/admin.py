@@ -1,21 +1,40 @@
-from flask import Blueprint, render_template, request, flash, redirect, jsonify
-from werkzeug.utils import secure_filename
+from flask import Blueprint, render_template, request, flash, redirect, jsonify, Response
 from bson.objectid import ObjectId
-from datetime import datetime
+from datetime import datetime, timedelta
 from entities.product import Product
 import os
 
-from routes.auth import require_role
-from database import dbConnection
+from routes.auth import require_role, invalidate_user_status, user_status_cache
+from database import get_db, pool_stats
+from exports import EXPORT_FORMATS, stream_export
+from images import PRODUCT_IMAGE_FOLDER, CATEGORY_IMAGE_FOLDER, save_upload, image_pipeline
 from routes.services import (
     get_all_categories, create_category, update_category, delete_category,
     get_all_products, create_product, update_product, delete_product, get_product_by_id,
-    get_all_stock, update_stock
+    get_all_stock, update_stock, get_users_by_ids, get_products_by_ids,
+    get_monthly_sales, get_sales_totals, get_top_products, bump_catalog_version,
+    get_order_count_by_status, get_top_customers,
+    get_category_counts, catalog_cache, fragment_cache, get_orders_page, order_board_row,
+    get_admin_dashboard, dashboard_cache,
+    get_user_directory, count_user_directory, invalidate_user_directory, directory_count_cache,
+    iter_orders_export, iter_order_lines_export, iter_sales_daily_export, iter_stock_export,
+    ORDER_EXPORT_FIELDS, ORDER_LINE_EXPORT_FIELDS, SALES_EXPORT_FIELDS, STOCK_EXPORT_FIELDS,
+    set_image_variants
 )
 
-UPLOAD_FOLDER = 'static/img/products'
+UPLOAD_FOLDER = PRODUCT_IMAGE_FOLDER
+PEDIDOS_POR_PAGINA = 25
+USUARIOS_POR_PAGINA = 25
+
+# tipo de exportación -> (iterador de filas, columnas, admite rango de fechas)
+EXPORTACIONES = {
+    "pedidos": (iter_orders_export, ORDER_EXPORT_FIELDS, True),
+    "lineas": (iter_order_lines_export, ORDER_LINE_EXPORT_FIELDS, True),
+    "ventas": (iter_sales_daily_export, SALES_EXPORT_FIELDS, True),
+    "inventario": (iter_stock_export, STOCK_EXPORT_FIELDS, False),
+}
 bp_admin = Blueprint("admin", __name__, url_prefix="/admin")
-db = dbConnection()
+db = get_db()
 
 def normalize_product(producto):
     """
@@ -38,71 +57,14 @@ def normalize_product(producto):
 @bp_admin.route("/")
 @require_role('admin')
 def admin_dashboard():
-    products = db['products']
-    categories = db['categories']
-    users = db['users']
-    orders = db['orders']
-
-    total_productos = products.count_documents({})
-    total_categorias = categories.count_documents({})
-    total_usuarios = users.count_documents({})
-    pedidos_pendientes = orders.count_documents({"status": "pendiente"})
-
-    productos_bajo_stock = list(products.find({'quantity': {'$lt': 5}}))
-    productos_top = list(products.find().sort("price", -1).limit(3))
-
-    ultimos_pedidos_db = orders.find().sort("date", -1).limit(5)
-    ultimos_pedidos = []
-    for p in ultimos_pedidos_db:
-        cliente_nombre = "Cliente no registrado"
-        if p.get("customer_id"):
-            cliente = users.find_one({"_id": ObjectId(p["customer_id"])})
-            if cliente:
-                cliente_nombre = cliente.get("username", "Cliente")
-        fecha = p.get("date", datetime.utcnow())
-        if isinstance(fecha, datetime):
-            fecha = fecha.strftime("%Y-%m-%d %H:%M")
-        ultimos_pedidos.append({
-            "id": str(p["_id"]),
-            "cliente": cliente_nombre,
-            "fecha": fecha,
-            "estado": p.get("status", "pendiente")
-        })
-
-    productos_populares = []
-    for prod in products.find().sort("quantity", -1).limit(5):
-        productos_populares.append({
-            "nombre": prod.get("name"),
-            "cantidad": prod.get("quantity", 0)
-        })
-
-    pipeline = [
-        {"$group": {"_id": "$customer_id", "total": {"$sum": 1}}},
-        {"$sort": {"total": -1}},
-        {"$limit": 5}
-    ]
-    top_clientes_db = list(orders.aggregate(pipeline))
-    clientes_top = []
-    for c in top_clientes_db:
-        cliente = users.find_one({"_id": c["_id"]}) if c["_id"] else None
-        clientes_top.append({
-            "nombre": cliente.get("username") if cliente else "Cliente",
-            "total": c["total"]
-        })
-
-    return render_template(
-        "admin/dashboard.html",
-        rol="admin",
-        total_productos=total_productos,
-        total_categorias=total_categorias,
-        total_usuarios=total_usuarios,
-        pedidos_pendientes=pedidos_pendientes,
-        stock_bajo=len(productos_bajo_stock),
-        productos_bajo_stock=productos_bajo_stock,
-        ultimos_pedidos=ultimos_pedidos,
-        productos_populares=productos_populares,
-        clientes_top=clientes_top,
-        productos_top=productos_top
+    # Una agregación $facet por colección, cacheada unos segundos
+    return render_template("admin/dashboard.html", rol="admin", **get_admin_dashboard())
+
+def _procesar_imagen(collection, folder, filename, field='image'):
+    """Genera las variantes WebP fuera de la petición y las guarda al terminar."""
+    image_pipeline.submit(
+        folder, filename,
+        on_done=lambda variantes: set_image_variants(collection, filename, variantes, field)
     )
 
 @bp_admin.route("/categorias")
@@ -121,11 +83,17 @@ def admin_categorias_agregar():
     name = request.form.get('name')
     icon = request.form.get('icon', '')  # si deseas guardar icono
     description = request.form.get('description', '')
+    icon_file = request.files.get('icon')
+    if icon_file and icon_file.filename != '':
+        icon = save_upload(icon_file, CATEGORY_IMAGE_FOLDER)
     db['categories'].insert_one({
         "name": name,
         "icon": icon,
         "description": description
     })
+    bump_catalog_version()
+    if icon_file and icon_file.filename != '':
+        _procesar_imagen('categories', CATEGORY_IMAGE_FOLDER, icon, field='icon')
     flash("Category added successfully", "success")
     return redirect("/admin/categorias")
 
@@ -135,10 +103,17 @@ def admin_categorias_editar(category_id):
     name = request.form.get('name')
     description = request.form.get('description', '')
     icon = request.form.get('icon', '')
-    db['categories'].update_one(
-        {"_id": ObjectId(category_id)},
-        {"$set": {"name": name, "description": description, "icon": icon}}
-    )
+    icon_file = request.files.get('icon')
+    cambios = {"$set": {"name": name, "description": description}}
+    if icon:
+        cambios["$set"]["icon"] = icon
+    if icon_file and icon_file.filename != '':
+        cambios["$set"]["icon"] = icon = save_upload(icon_file, CATEGORY_IMAGE_FOLDER)
+        cambios["$unset"] = {"icon_variants": ""}
+    db['categories'].update_one({"_id": ObjectId(category_id)}, cambios)
+    bump_catalog_version()
+    if "$unset" in cambios:
+        _procesar_imagen('categories', CATEGORY_IMAGE_FOLDER, icon, field='icon')
     flash("Category updated successfully", "success")
     return redirect("/admin/categorias")
 
@@ -179,9 +154,7 @@ def admin_productos_agregar():
     image_file = request.files.get('image')
     image_filename = None
     if image_file and image_file.filename != '':
-        filename = secure_filename(image_file.filename)
-        image_file.save(os.path.join(UPLOAD_FOLDER, filename))
-        image_filename = filename
+        image_filename = save_upload(image_file, UPLOAD_FOLDER)
 
     product = Product(name=name,
                       description=description,
@@ -191,6 +164,9 @@ def admin_productos_agregar():
                       quantity=quantity,
                       image=image_filename)
     db.products.insert_one(product.to_dict())
+    bump_catalog_version()
+    if image_filename:
+        _procesar_imagen('products', UPLOAD_FOLDER, image_filename)
 
     flash("Producto agregado correctamente", "success")
     return redirect('/admin/productos')
@@ -209,15 +185,19 @@ def admin_productos_editar(product_id):
 
     # Manejo de imagen
     image_file = request.files.get('image')
+    cambios = {"$set": data}
     if image_file and image_file.filename != '':
-        filename = secure_filename(image_file.filename)
-        image_file.save(os.path.join(UPLOAD_FOLDER, filename))
-        data['image'] = filename
+        data['image'] = save_upload(image_file, UPLOAD_FOLDER)
+        # Las variantes de la imagen anterior ya no sirven; el worker pone las nuevas
+        cambios["$unset"] = {"image_variants": ""}
 
     try:
-        db.products.update_one({"_id": ObjectId(product_id)}, {"$set": data})
+        db.products.update_one({"_id": ObjectId(product_id)}, cambios)
     except:
-        db.products.update_one({"_id": product_id}, {"$set": data})  # fallback si _id es string
+        db.products.update_one({"_id": product_id}, cambios)  # fallback si _id es string
+    bump_catalog_version()
+    if 'image' in data:
+        _procesar_imagen('products', UPLOAD_FOLDER, data['image'])
 
     flash("Producto actualizado correctamente", "success")
     return redirect('/admin/productos')
@@ -226,6 +206,7 @@ def admin_productos_editar(product_id):
 @require_role('admin')
 def admin_productos_eliminar(product_id):
     db['products'].delete_one({"_id": ObjectId(product_id)})
+    bump_catalog_version()
     flash("Product deleted successfully", "success")
     return redirect("/admin/productos")
 
@@ -264,16 +245,21 @@ def actualizar_stock():
 @require_role('admin')
 def admin_reportes():
     products_collection = db['products']
-    orders_collection = db['orders']
     categories_collection = db['categories']
-    users_collection = db['users']
 
-    # =================== VENTAS ===================
-    ventas_hoy = sum(p.get('price', 0) * p.get('quantity', 0) for p in products_collection.find())
-    ventas_mes = ventas_hoy * 30
-    ventas_anio = ventas_mes * 12
-    pedidos_completados = orders_collection.count_documents({'status': 'pagado'})
-    promedio_pedido = ventas_hoy / orders_collection.count_documents({}) if orders_collection.count_documents({}) > 0 else 0
+    # =================== VENTAS (desde sales_daily y order_counters) ===================
+    ahora = datetime.utcnow()
+    hoy = datetime(ahora.year, ahora.month, ahora.day)
+    inicio_mes = datetime(ahora.year, ahora.month, 1)
+    inicio_anio = datetime(ahora.year, 1, 1)
+    manana = hoy + timedelta(days=1)
+
+    ventas_hoy = get_sales_totals(hoy, manana)['revenue']
+    ventas_mes = get_sales_totals(inicio_mes, manana)['revenue']
+    totales_anio = get_sales_totals(inicio_anio, manana)
+    ventas_anio = totales_anio['revenue']
+    pedidos_completados = get_order_count_by_status('pagado')
+    promedio_pedido = round(ventas_anio / totales_anio['orders'], 2) if totales_anio['orders'] > 0 else 0
 
     # PRODUCTOS BAJO STOCK
     productos_bajo_stock = list(products_collection.find({'inventory.current_quantity': {'$lt': 5}}))
@@ -283,61 +269,20 @@ def admin_reportes():
 
     # =================== PRODUCTOS POR CATEGORÍA ===================
     categorias = list(categories_collection.find())
+    conteo = get_category_counts()
     productos_por_categoria = []
     for cat in categorias:
-        count = products_collection.count_documents({'category_id': cat['_id']})
-        productos_por_categoria.append({'categoria': cat['name'], 'cantidad': count})
+        productos_por_categoria.append({'categoria': cat['name'], 'cantidad': conteo.get(str(cat['_id']), 0)})
 
     # =================== PRODUCTOS MÁS VENDIDOS ===================
-    pipeline_productos_top = [
-        {"$unwind": "$details"},  # Separar cada detalle del pedido
-        {"$group": {
-            "_id": "$details.product_id",
-            "total_vendido": {"$sum": "$details.quantity"}
-        }},
-        {"$sort": {"total_vendido": -1}},  # De mayor a menor
-        {"$limit": 5}
-    ]
-    top_productos_db = list(orders_collection.aggregate(pipeline_productos_top))
-    productos_top = []
-    for p in top_productos_db:
-        prod = products_collection.find_one({"_id": ObjectId(p["_id"])})
-        if prod:
-            productos_top.append({
-                "nombre": prod["name"],
-                "cantidad": p["total_vendido"]
-            })
+    productos_top = get_top_products(limit=5)
 
     # =================== CLIENTES CON MÁS COMPRAS ===================
-    pipeline_clientes_top = [
-        {"$group": {"_id": "$customer_id", "total_compras": {"$sum": 1}}},
-        {"$sort": {"total_compras": -1}},
-        {"$limit": 5}
-    ]
-    top_clientes_db = list(orders_collection.aggregate(pipeline_clientes_top))
-    clientes_top = []
-    for c in top_clientes_db:
-        cliente = users_collection.find_one({"_id": c["_id"]}) if c["_id"] else None
-        clientes_top.append({
-            "nombre": cliente["username"] if cliente else "Cliente",
-            "compras": c["total_compras"]
-        })
+    clientes_top = get_top_customers(limit=5)
 
-    # =================== VENTAS POR MES (OPCIONAL) ===================
-    # Puedes calcular un resumen simple por mes si quieres
-    ventas_por_mes = []
-    for i in range(1, 13):
-        inicio_mes = datetime(datetime.utcnow().year, i, 1)
-        if i == 12:
-            fin_mes = datetime(datetime.utcnow().year + 1, 1, 1)
-        else:
-            fin_mes = datetime(datetime.utcnow().year, i + 1, 1)
-        total_mes = sum(
-            detail['quantity'] * products_collection.find_one({"_id": ObjectId(detail['product_id'])})['price']
-            for order in orders_collection.find({"date": {"$gte": inicio_mes, "$lt": fin_mes}})
-            for detail in order['details']
-        )
-        ventas_por_mes.append({"mes": inicio_mes.strftime("%B"), "total": total_mes})
+    # =================== VENTAS POR MES ===================
+    anio = request.args.get("anio", type=int) or datetime.utcnow().year
+    ventas_por_mes = get_monthly_sales(anio)
 
     return render_template(
         "admin/reportes.html",
@@ -351,25 +296,83 @@ def admin_reportes():
         clientes_top=clientes_top,
         productos_bajo_stock=productos_bajo_stock,
         productos_por_categoria=productos_por_categoria,
-        ventas_por_mes=ventas_por_mes
+        ventas_por_mes=ventas_por_mes,
+        anio=anio
+    )
+
+# ===================== EXPORTACIONES =====================
+@bp_admin.route("/exportar/<tipo>")
+@require_role('admin')
+def admin_exportar(tipo):
+    """
+    Descarga en streaming: ?formato=csv|ndjson y, salvo inventario,
+    ?desde=YYYY-MM-DD&hasta=YYYY-MM-DD (ambos días incluidos).
+    """
+    if tipo not in EXPORTACIONES:
+        return jsonify({"ok": False, "msg": "Exportación no encontrada"}), 404
+    formato = request.args.get("formato", "csv")
+    if formato not in EXPORT_FORMATS:
+        return jsonify({"ok": False, "msg": "Formato no soportado"}), 400
+
+    iterador, campos, con_fechas = EXPORTACIONES[tipo]
+    partes = [tipo]
+    if con_fechas:
+        try:
+            desde = request.args.get("desde")
+            hasta = request.args.get("hasta")
+            desde = datetime.strptime(desde, "%Y-%m-%d") if desde else None
+            hasta = datetime.strptime(hasta, "%Y-%m-%d") + timedelta(days=1) if hasta else None
+        except ValueError:
+            return jsonify({"ok": False, "msg": "Fechas inválidas (usa YYYY-MM-DD)"}), 400
+        filas = iterador(desde, hasta)
+        partes += [request.args[k] for k in ("desde", "hasta") if request.args.get(k)]
+    else:
+        filas = iterador()
+
+    nombre = "_".join(partes) + "." + formato
+    return Response(
+        stream_export(filas, campos, formato),
+        content_type=EXPORT_FORMATS[formato],
+        headers={"Content-Disposition": f'attachment; filename="{nombre}"'}
     )
 
 @bp_admin.route("/pedidos")
 @require_role('admin')
 def ver_pedidos():
-    orders_collection = db['orders']
-    users_collection = db['users']
-    products_collection = db['products']
-
     pedidos = []
 
-    for o in orders_collection.find().sort("date", -1):
+    # Una página (keyset sobre date, _id) con los filtros de la URL
+    filtros = {
+        "estado": request.args.get("estado", ""),
+        "cliente": request.args.get("cliente", ""),
+        "empleado": request.args.get("empleado", "")
+    }
+    pedidos_db, siguiente, anterior = get_orders_page(
+        status=filtros["estado"] or None,
+        customer_id=filtros["cliente"] or None,
+        employee_id=filtros["empleado"] or None,
+        after=request.args.get("despues"),
+        before=request.args.get("antes"),
+        limit=PEDIDOS_POR_PAGINA
+    )
+
+    # Resolver clientes y productos referenciados con una consulta $in por colección
+    filas = {o["_id"]: order_board_row(o) for o in pedidos_db}
+    clientes_map = get_users_by_ids(cliente_id for cliente_id, _, _ in filas.values())
+    productos_map = get_products_by_ids(
+        item.get("product_id")
+        for o in pedidos_db if not o.get("total")
+        for item in o.get("details", [])
+    )
+
+    for o in pedidos_db:
+        cliente_id, estado, carrito = filas[o["_id"]]
+
         # Determinar el nombre del cliente
         cliente_nombre = "Cliente no registrado"
-        if o.get("customer_id"):
-            cliente = users_collection.find_one({"_id": ObjectId(o["customer_id"])})
-            if cliente:
-                cliente_nombre = cliente.get("username", "Cliente")
+        cliente = clientes_map.get(str(cliente_id))
+        if cliente:
+            cliente_nombre = cliente.get("username", "Cliente")
         
         # Determinar si lo creó un empleado
         creado_por_empleado = False
@@ -385,7 +388,7 @@ def ver_pedidos():
         total = o.get("total")
         if not total:
             total = sum(
-                item['quantity'] * products_collection.find_one({"_id": ObjectId(item['product_id'])})['price']
+                item['quantity'] * productos_map.get(str(item['product_id']), {}).get('price', 0)
                 for item in o.get("details", [])
             )
 
@@ -394,21 +397,29 @@ def ver_pedidos():
             "cliente": cliente_nombre,
             "fecha": fecha,
             "total": total,
-            "estado": o.get("status", "pendiente"),
+            "estado": estado,
+            "carrito": carrito,
             "creado_por_empleado": creado_por_empleado
         })
 
     return render_template(
         "empleado/pedidos.html",
-        pedidos=pedidos  # Usamos solo una lista para la plantilla
+        pedidos=pedidos,  # Usamos solo una lista para la plantilla
+        filtros=filtros,
+        siguiente=siguiente,
+        anterior=anterior
     )
 
 # ===================== CLIENTES =====================
 @bp_admin.route("/clientes")
 @require_role('admin')
 def admin_clientes():
-    users_collection = db['users']
-    clientes = list(users_collection.find({"role": "cliente"}))
+    # Una página del directorio (keyset por nombre) con búsqueda por prefijo
+    q = request.args.get("q", "").strip()
+    clientes, siguiente = get_user_directory(
+        "cliente", q=q, after=request.args.get("despues"), limit=USUARIOS_POR_PAGINA
+    )
+    total, total_exacto = count_user_directory("cliente", q)
     
     # Preparar para enviar al template (convertir ObjectId a string)
     clientes_list = []
@@ -417,11 +428,19 @@ def admin_clientes():
             "id": str(c["_id"]),
             "nombre": c.get("username"),
             "correo": c.get("email"),
-            "telefono": c.get("telefono"),
-            "direccion": c.get("direccion")
+            "telefono": c.get("telefono") or c.get("phone"),
+            "direccion": c.get("direccion") or c.get("address")
         })
     
-    return render_template("admin/clientes.html", clientes=clientes_list, rol="admin")
+    return render_template(
+        "admin/clientes.html",
+        clientes=clientes_list,
+        q=q,
+        siguiente=siguiente,
+        total=total,
+        total_exacto=total_exacto,
+        rol="admin"
+    )
 
 
 @bp_admin.route("/clientes/crear", methods=["POST"])
@@ -441,6 +460,7 @@ def admin_clientes_crear():
         "direccion": data.get("direccion"),
         "role": "cliente"
     })
+    invalidate_user_directory()
     return jsonify({"ok": True, "msg": "Cliente creado correctamente"})
 
 
@@ -459,6 +479,8 @@ def admin_clientes_editar(id):
             "direccion": data.get("direccion")
         }}
     )
+    invalidate_user_status(id)
+    invalidate_user_directory()
     return jsonify({"ok": True, "msg": "Cliente actualizado correctamente"})
 
 
@@ -467,14 +489,19 @@ def admin_clientes_editar(id):
 def admin_clientes_eliminar(id):
     users_collection = db['users']
     users_collection.delete_one({"_id": ObjectId(id)})
+    invalidate_user_status(id)
+    invalidate_user_directory()
     return jsonify({"ok": True, "msg": "Cliente eliminado correctamente"})
 
 # ===================== EMPLEADOS =====================
 @bp_admin.route("/empleados")
 @require_role('admin')
 def admin_empleados():
-    users_collection = db['users']
-    empleados = list(users_collection.find({"role": "empleado"}))
+    q = request.args.get("q", "").strip()
+    empleados, siguiente = get_user_directory(
+        "empleado", q=q, after=request.args.get("despues"), limit=USUARIOS_POR_PAGINA
+    )
+    total, total_exacto = count_user_directory("empleado", q)
     
     empleados_list = []
     for e in empleados:
@@ -485,7 +512,15 @@ def admin_empleados():
             "correo": e.get("email")
         })
     
-    return render_template("admin/empleados.html", empleados=empleados_list, rol="admin")
+    return render_template(
+        "admin/empleados.html",
+        empleados=empleados_list,
+        q=q,
+        siguiente=siguiente,
+        total=total,
+        total_exacto=total_exacto,
+        rol="admin"
+    )
 
 
 @bp_admin.route("/empleados/crear", methods=["POST"])
@@ -500,6 +535,7 @@ def admin_empleados_crear():
         "cargo": data.get("cargo"),
         "role": "empleado"
     })
+    invalidate_user_directory()
     return jsonify({"ok": True, "msg": "Empleado creado correctamente"})
 
 
@@ -517,6 +553,8 @@ def admin_empleados_editar(id):
             "cargo": data.get("cargo")
         }}
     )
+    invalidate_user_status(id)
+    invalidate_user_directory()
     return jsonify({"ok": True, "msg": "Empleado actualizado correctamente"})
 
 
@@ -525,9 +563,30 @@ def admin_empleados_editar(id):
 def admin_empleados_eliminar(id):
     users_collection = db['users']
     users_collection.delete_one({"_id": ObjectId(id)})
+    invalidate_user_status(id)
+    invalidate_user_directory()
     return jsonify({"ok": True, "msg": "Empleado eliminado correctamente"})
 
 
+# ===================== BASE DE DATOS =====================
+@bp_admin.route("/db/pool")
+@require_role('admin')
+def admin_db_pool():
+    return jsonify(pool_stats())
+
+
+@bp_admin.route("/cache/stats")
+@require_role('admin')
+def admin_cache_stats():
+    return jsonify({
+        "user_status": user_status_cache.stats(),
+        "catalog": catalog_cache.stats(),
+        "fragments": fragment_cache.stats(),
+        "dashboard": dashboard_cache.stats(),
+        "directory_counts": directory_count_cache.stats()
+    })
+
+
 @bp_admin.errorhandler(404)
 def not_found(error=None):
     message = {'message': 'No encontrado: ' + request.url, 'status': 404}
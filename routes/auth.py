@@ -3,11 +3,37 @@ from werkzeug.security import generate_password_hash, check_password_hash
 from bson.objectid import ObjectId
 from datetime import datetime
 from entities.user import User
-from database import dbConnection
+from database import get_db
 from functools import wraps
+from pymongo.errors import DuplicateKeyError
+from cache import TTLCache
+import os
 
 auth_bp = Blueprint("auth", __name__)
-db = dbConnection()
+db = get_db()
+
+# Caché del estado "is_active" de cada usuario para no consultar Mongo en cada request
+user_status_cache = TTLCache(
+    maxsize=int(os.environ.get("USER_STATUS_CACHE_SIZE", 2048)),
+    ttl=int(os.environ.get("USER_STATUS_CACHE_TTL", 30)),
+    name="user_status"
+)
+
+
+def get_user_status(user_id):
+    """Devuelve True/False según is_active, o None si el usuario no existe."""
+    def load():
+        user_data = db['users'].find_one({'_id': ObjectId(user_id)}, {'is_active': 1})
+        if not user_data:
+            return None
+        return bool(user_data.get('is_active', True))
+
+    return user_status_cache.get_or_load(str(user_id), load)
+
+
+def invalidate_user_status(user_id):
+    """Llamar cuando un usuario se edita, desactiva o elimina."""
+    user_status_cache.invalidate(str(user_id))
 
 # ============================================================
 #                          LOGIN
@@ -33,6 +59,8 @@ def login():
         if not user.is_active:
             return render_template("auth/login.html", error="Cuenta desactivada")
 
+        # Id de sesión nuevo al autenticarse (evita la fijación de sesión)
+        session.regenerate()
         session['user_id'] = str(user_data['_id'])
         session['username'] = user.username
         session['role'] = user.role.strip().lower()
@@ -61,14 +89,6 @@ def register():
 
         users_collection = db['users']
 
-        existing_user = users_collection.find_one({
-            '$or': [{'username': username}, {'email': email}]
-        })
-
-        if existing_user:
-            return render_template("auth/register.html",
-                                   error="El usuario o email ya están registrados")
-
         if role == 'admin' and session.get('role') != 'admin':
             role = 'cliente'
 
@@ -81,9 +101,16 @@ def register():
             'created_at': datetime.utcnow()
         }
 
-        result = users_collection.insert_one(new_user)
+        # Sin consulta previa: los índices únicos username_unique/email_unique
+        # (creados al arrancar) rechazan el duplicado, también si es simultáneo
+        try:
+            result = users_collection.insert_one(new_user)
+        except DuplicateKeyError:
+            return render_template("auth/register.html",
+                                   error="El usuario o email ya están registrados")
 
         if result.inserted_id:
+            session.regenerate()
             session['user_id'] = str(result.inserted_id)
             session['username'] = username
             session['email'] = email
@@ -129,10 +156,9 @@ def before_request():
     if 'user_id' not in session:
         return redirect('/login')
 
-    # 3️⃣ Verificar usuario activo
+    # 3️⃣ Verificar usuario activo (con caché)
     try:
-        user_data = db['users'].find_one({'_id': ObjectId(session['user_id'])})
-        if not user_data or not user_data.get('is_active', True):
+        if not get_user_status(session['user_id']):
             session.clear()
             return redirect('/login')
     except:
@@ -1,16 +1,25 @@
-from flask import Blueprint, render_template, request, session, flash, redirect, current_app
+from flask import Blueprint, render_template, request, session, flash, redirect
 from bson.objectid import ObjectId
-from database import dbConnection
+from database import get_db
 from routes.auth import require_role  
 from datetime import datetime
-from routes.services import verificar_y_ajustar_stock
+from routes.services import (
+    ajustar_stock_lote, record_order_change, search_products,
+    get_catalog_products, get_catalog_categories, get_catalog_category_counts,
+    get_catalog_product, get_related_products, get_products_by_ids,
+    conditional_catalog_page
+)
+from pymongo.errors import PyMongoError
+from session_store import cart_store
 from werkzeug.utils import secure_filename
-import os
+from assets import StaticDirIndex
 
 UPLOAD_FOLDER = 'static/img/products'  # misma carpeta que admin
+POR_PAGINA = 12  # resultados por página en la búsqueda
+HERO_BANNERS = StaticDirIndex("img/hero", ('.jpg', '.jpeg', '.png'))  # banner1, banner2, etc.
 
 bp_cliente = Blueprint("cliente", __name__, url_prefix="/cliente")
-db = dbConnection()
+db = get_db()
 # ============================================================
 #                   ROL: CLIENTE
 # ============================================================
@@ -23,8 +32,8 @@ def format_product_for_template(product):
         'cantidad': product.get('quantity', 0),      # puedes dejarlo, pero
         'categoria_id': product.get("category_id", ""),
         'estado': product.get('status', 'Desconocido'),
-        'imagen': product.get('image', 'cupcake.jpg')
-        
+        'imagen': product.get('image', 'cupcake.jpg'),
+        'imagen_variantes': product.get('image_variants') or {}
     }
 
 
@@ -34,34 +43,23 @@ def format_category_for_template(category):
         'id': str(category.get('_id', '')),
         'nombre': category.get('name', 'Sin nombre'),
         'icono': category.get('icon', 'cupcake.jpg'),   # campo correcto de BD
+        'icono_variantes': category.get('icon_variants') or {},
         'descripcion': category.get('description', '')  # campo correcto de BD
     }
     
 @bp_cliente.route("/")
 def cliente_dashboard():
-    # Obtener productos y categorías de la BD
-    products_collection = db['products']
-    categories_collection = db['categories']
-    
+    # Obtener productos y categorías del caché del catálogo
     # Productos disponibles (limitar a 8 para home)
-    productos_db = list(products_collection.find({'status': 'Disponible'}).limit(8))
+    productos_db = get_catalog_products()[:8]
     productos = [format_product_for_template(p) for p in productos_db]
     
     # Categorías
-    categorias_db = list(categories_collection.find().limit(6))
+    categorias_db = get_catalog_categories()[:6]
     categorias = [format_category_for_template(c) for c in categorias_db]
 
-    # ==== CARGAR AUTOMÁTICAMENTE LOS BANNERS DEL HERO ====
-    hero_dir= os.path.join(current_app.static_folder, "img/hero")
-    
-    # lista solo archivos válidos (jpg, png, jpeg)
-    banners = [
-        f"img/hero/{f}"
-          for f in os.listdir(hero_dir)
-        if f.lower().endswith(('.jpg', '.jpeg', '.png'))
-    ]
-
-    banners.sort()  # opcional: banner1, banner2, etc.
+    # ==== BANNERS DEL HERO (listado cacheado de static/img/hero) ====
+    banners = list(HERO_BANNERS.files())
 
     # Rol actual
     rol_actual = session.get("role", "cliente")
@@ -75,16 +73,17 @@ def cliente_dashboard():
     )
 
 @bp_cliente.route("/productos")
+@conditional_catalog_page
 def cliente_productos():
-    products_collection = db['products']
-    categories_collection = db['categories']
-
     # ================================
     #   CARGAR CATEGORÍAS
     # ================================
-    categorias_db = list(categories_collection.find())
+    categorias_db = get_catalog_categories()
     categorias = []
 
+    # Productos disponibles por categoría (una sola agregación, en caché)
+    conteo = get_catalog_category_counts()
+
     for c in categorias_db:
         cat_id = str(c["_id"])
 
@@ -93,29 +92,22 @@ def cliente_productos():
             "nombre": c.get("name", "Sin nombre"),
             "descripcion": c.get("description", ""),
             "icono": c.get("icon", "default.jpg"),
-
-            # Contar productos asociados a esta categoría
-            "cantidad_productos": products_collection.count_documents({
-                "category_id": cat_id,
-                "status": "Disponible"
-            })
+            "cantidad_productos": conteo.get(cat_id, 0)
         })
 
     # ================================
     #   MANEJAR BÚSQUEDA
     # ================================
     buscar = request.args.get('buscar', '').strip()
+    pagina = max(request.args.get('pagina', 1, type=int), 1)
+    total_paginas = 1
 
     if buscar:
-        productos_db = list(products_collection.find({
-            "status": "Disponible",
-            "$or": [
-                {"name": {"$regex": buscar, "$options": "i"}},
-                {"description": {"$regex": buscar, "$options": "i"}}
-            ]
-        }))
+        # Índice invertido en memoria: sin tildes, por prefijo y ordenado por relevancia
+        productos_db, total = search_products(buscar, pagina, POR_PAGINA)
+        total_paginas = max((total + POR_PAGINA - 1) // POR_PAGINA, 1)
     else:
-        productos_db = list(products_collection.find({"status": "Disponible"}))
+        productos_db = get_catalog_products()
 
     # Reformatear productos
     productos = [format_product_for_template(p) for p in productos_db]
@@ -127,19 +119,20 @@ def cliente_productos():
         "cliente/productos.html",
         productos=productos,
         categorias=categorias,
+        buscar=buscar,
+        pagina=pagina,
+        total_paginas=total_paginas,
         rol=session.get("role", "cliente")
     )
 
 
 @bp_cliente.route("/categorias")
+@conditional_catalog_page
 def cliente_categorias():
-    categories_collection = db['categories']
-    products_collection = db['products']
-
     # ================================
     #       CARGAR CATEGORÍAS
     # ================================
-    categorias_db = list(categories_collection.find())
+    categorias_db = get_catalog_categories()
     categorias = []
 
     for c in categorias_db:
@@ -155,18 +148,13 @@ def cliente_categorias():
     # ================================
     #       CARGAR PRODUCTOS
     # ================================
-    productos_db = list(products_collection.find({"status": "Disponible"}))
+    productos_db = get_catalog_products()
     productos = [format_product_for_template(p) for p in productos_db]
 
     # ================================
     #   CONTAR PRODUCTOS POR CATEGORÍA
     # ================================
-    conteo = {}
-
-    for cat in categorias:
-        conteo[cat["id"]] = sum(
-            1 for p in productos if p["categoria_id"] == cat["id"]
-        )
+    conteo = get_catalog_category_counts()
 
     # ================================
     #       ENVIAR AL TEMPLATE
@@ -189,28 +177,44 @@ def cliente_carrito():
         return redirect('/login')
     
     productos_carrito = []
+    no_disponibles = []
     total = 0
     
-    if 'carrito' in session and session['carrito']:
-        carrito_items = session['carrito']
-        products_collection = db['products']
-        
-        for product_id, cantidad in carrito_items.items():
-            try:
-                producto_db = products_collection.find_one({'_id': ObjectId(product_id)})
-                if producto_db and producto_db.get('status') == 'Disponible':
-                    # Formatear producto para el template
-                    producto = format_product_for_template(producto_db)
-                    producto['cantidad'] = cantidad
-                    producto['subtotal'] = producto['precio'] * cantidad
-                    productos_carrito.append(producto)
-                    total += producto['subtotal']
-            except:
-                continue
-    
+    try:
+        carrito_items = cart_store.get(session['user_id'])
+        # Una sola consulta $in para todas las líneas del carrito
+        productos_db = get_products_by_ids(carrito_items.keys(), {
+            'name': 1, 'price': 1, 'status': 1, 'image': 1, 'image_variants': 1
+        })
+    except PyMongoError:
+        return render_template("cliente/carrito.html",
+                               productos=[],
+                               no_disponibles=[],
+                               total=0,
+                               error="No se pudo cargar el carrito. Intenta de nuevo en unos segundos.",
+                               rol=session.get('role', 'cliente')), 503
+
+    for product_id, cantidad in carrito_items.items():
+        producto_db = productos_db.get(product_id)
+        if not producto_db or producto_db.get('status') != 'Disponible':
+            no_disponibles.append({
+                'id': product_id,
+                'nombre': producto_db.get('name', 'Producto') if producto_db else 'Producto eliminado',
+                'cantidad': cantidad
+            })
+            continue
+
+        # Formatear producto para el template
+        producto = format_product_for_template(producto_db)
+        producto['cantidad'] = cantidad
+        producto['subtotal'] = producto['precio'] * cantidad
+        productos_carrito.append(producto)
+        total += producto['subtotal']
+
     rol_actual = session.get('role', 'cliente')
     return render_template("cliente/carrito.html", 
                          productos=productos_carrito, 
+                         no_disponibles=no_disponibles,
                          total=total,
                          rol=rol_actual)
 
@@ -225,7 +229,9 @@ def cliente_mis_pedidos():
     # Obtener pedidos del usuario
     if 'orders' in db.list_collection_names():
         orders_collection = db['orders']
-        pedidos_db = list(orders_collection.find({'user_id': session['user_id']}))
+        pedidos_db = list(
+            orders_collection.find({'user_id': session['user_id']}).sort([('date', -1), ('_id', -1)])
+        )
         
         # Formatear pedidos
         pedidos = []
@@ -252,20 +258,8 @@ def agregar_al_carrito(product_id):
 
     cantidad = int(request.form.get("cantidad", 1))
 
-    # Crear el carrito si no existe
-    if "carrito" not in session:
-        session["carrito"] = {}
-
-    # Convertir id a string
-    product_id = str(product_id)
-
-    # Actualizar cantidad si el producto ya está
-    if product_id in session["carrito"]:
-        session["carrito"][product_id] += cantidad
-    else:
-        session["carrito"][product_id] = cantidad
-
-    session.modified = True
+    # Suma la cantidad a la línea (la crea si no existe) en una sola escritura
+    cart_store.add(session["user_id"], str(product_id), cantidad)
 
     flash("Producto agregado al carrito", "success")
     return redirect("/cliente/carrito")
@@ -274,12 +268,7 @@ def agregar_al_carrito(product_id):
 @require_role("cliente")
 def eliminar_del_carrito(product_id):
 
-    product_id = str(product_id)
-
-    if "carrito" in session and product_id in session["carrito"]:
-        session["carrito"].pop(product_id)
-
-    session.modified = True
+    cart_store.remove(session["user_id"], str(product_id))
     flash("Producto eliminado del carrito", "success")
 
     return redirect("/cliente/carrito")
@@ -289,18 +278,11 @@ def actualizar_cantidad(product_id, accion):
 
     product_id = str(product_id)
 
-    if "carrito" not in session or product_id not in session["carrito"]:
-        return redirect("/cliente/carrito")
-
     if accion == "sumar":
-        session["carrito"][product_id] += 1
+        cart_store.add(session["user_id"], product_id, 1)
     elif accion == "restar":
-        if session["carrito"][product_id] > 1:
-            session["carrito"][product_id] -= 1
-        else:
-            session["carrito"].pop(product_id)
+        cart_store.decrement(session["user_id"], product_id)
 
-    session.modified = True
     return redirect("/cliente/carrito")
 
 # ============================================================
@@ -313,19 +295,30 @@ def cliente_pagar():
     print("🔥 ENTRANDO A /pagar")
     print("ROL:", session.get("role"))
 
-    if "carrito" not in session or not session["carrito"]:
+    carrito = cart_store.get(session["user_id"])
+    if not carrito:
         flash("Tu carrito está vacío", "error")
         return redirect("/cliente/carrito")
 
-    carrito = session["carrito"]
-    products_collection = db["products"]
+    # 1 consulta: precios, estado y stock de todos los productos del carrito
+    productos_db = get_products_by_ids(carrito.keys(), {
+        "name": 1, "price": 1, "status": 1, "inventory.current_quantity": 1
+    })
 
     productos_pedido = []
     total = 0
+    errores = []
 
+    # Validar disponibilidad en memoria antes de escribir nada
     for product_id, cantidad in carrito.items():
-        producto_db = products_collection.find_one({"_id": ObjectId(product_id)})
-        if not producto_db:
+        producto_db = productos_db.get(product_id)
+        if not producto_db or producto_db.get("status") != "Disponible":
+            errores.append("Un producto de tu carrito ya no está disponible")
+            continue
+
+        stock_actual = producto_db.get("inventory", {}).get("current_quantity", 0)
+        if stock_actual < cantidad:
+            errores.append(f"No se puede pedir {producto_db['name']}: Stock insuficiente: solo quedan {stock_actual}")
             continue
 
         subtotal = producto_db["price"] * cantidad
@@ -340,54 +333,63 @@ def cliente_pagar():
 
         total += subtotal
 
+    if errores:
+        for error in errores:
+            flash(error, "error")
+        return redirect("/cliente/carrito")
+
     if not productos_pedido:
         flash("No se pudo generar el pedido", "error")
         return redirect("/cliente/carrito")
 
-    for item in productos_pedido:
-        ok, msg = verificar_y_ajustar_stock(item["product_id"], -item["cantidad"])
-        if not ok:
-            flash(f"No se puede pedir {item['nombre']}: {msg}", "error")
-            return redirect("/cliente/carrito")
+    # Reservar el stock de todas las líneas a la vez (todo o nada)
+    ok, resultados = ajustar_stock_lote(
+        [(item["product_id"], -item["cantidad"]) for item in productos_pedido]
+    )
+    if not ok:
+        for item, resultado in zip(productos_pedido, resultados):
+            if not resultado["ok"]:
+                flash(f"No se puede pedir {item['nombre']}: {resultado['msg']}", "error")
+        return redirect("/cliente/carrito")
 
     pedido = {
         "user_id": session["user_id"],
         "productos": productos_pedido,
         "total": total,
         "estado": "Pendiente",
-        "fecha": datetime.now().strftime("%Y-%m-%d %H:%M")
+        "fecha": datetime.now().strftime("%Y-%m-%d %H:%M"),
+        # 'date' (UTC) es por donde se ordenan y paginan los tableros de pedidos
+        "date": datetime.utcnow()
     }
 
-    db["orders"].insert_one(pedido)
+    try:
+        db["orders"].insert_one(pedido)
+    except PyMongoError:
+        # Devolver el stock reservado si no se pudo guardar el pedido
+        ajustar_stock_lote([(item["product_id"], item["cantidad"]) for item in productos_pedido])
+        flash("No se pudo generar el pedido", "error")
+        return redirect("/cliente/carrito")
+    record_order_change(None, pedido)
 
-    session["carrito"] = {}
-    session.modified = True
+    cart_store.clear(session["user_id"])
 
     flash("¡Pedido realizado con éxito!", "success")
     return redirect("/cliente/mis_pedidos")
 @bp_cliente.route("/producto/<product_id>")
 @require_role('cliente')
+@conditional_catalog_page
 def cliente_detalle_producto(product_id):
-    products_collection = db['products']
-
     try:
-        # Producto principal
-        producto_db = products_collection.find_one({'_id': ObjectId(product_id)})
+        # Producto principal (desde el caché del catálogo)
+        producto_db = get_catalog_product(product_id)
         if not producto_db:
             flash("Producto no encontrado", "error")
             return redirect("/cliente/productos")
         
         producto = format_product_for_template(producto_db)
 
-        # 🔥 CAMBIO: usar categoria_id correcto
-        categoria_id = producto['categoria_id']
-
-        # 🔥 CAMBIO: buscar por category_id (NO "category")
-        relacionados_db = list(products_collection.find({
-            "category_id": categoria_id,
-            "_id": {"$ne": ObjectId(product_id)},  # excluir producto actual
-            "status": "Disponible"
-        }).limit(3))
+        # Relacionados: misma category_id, disponibles, sin el producto actual
+        relacionados_db = get_related_products(producto_db, limit=3)
 
         relacionados = [format_product_for_template(r) for r in relacionados_db]
 
@@ -1,17 +1,25 @@
 from flask import Blueprint, render_template, request, redirect, flash, session,jsonify
 from bson.objectid import ObjectId
-from routes.auth import require_employee_or_admin
-from database import dbConnection
+from routes.auth import require_employee_or_admin, invalidate_user_status
+from database import get_db
 from entities.user import User
 from datetime import datetime
 from werkzeug.security import generate_password_hash
-from routes.services import verificar_y_ajustar_stock
+from routes.services import (
+    ajustar_stock_lote, get_users_by_ids, get_products_by_ids, record_order_change,
+    get_orders_page, get_user_directory, count_user_directory, invalidate_user_directory,
+    get_employee_panel, order_board_row
+)
 
 
 UPLOAD_FOLDER = 'static/img/products'  # misma carpeta que admin
+PEDIDOS_POR_PAGINA = 25  # tablero de pedidos
+PEDIDOS_PANEL = 10       # pedidos recientes en el panel principal
+CLIENTES_POR_PAGINA = 25 # directorio de clientes
+SUGERENCIAS_CLIENTES = 10  # autocompletado al crear un pedido
 
 bp_empleado = Blueprint("empleado", __name__, url_prefix="/empleado")
-db = dbConnection()
+db = get_db()
 def format_product_for_template(product):
     return {
         'id': str(product.get('_id', '')),
@@ -21,7 +29,8 @@ def format_product_for_template(product):
         'quantity': product.get('inventory', {}).get('current_quantity', 0),
         'category': product.get('category_name', 'General'),
         'status': product.get('status', 'Desconocido'),
-        'image': product.get('image', 'cupcake.jpg')
+        'image': product.get('image', 'cupcake.jpg'),
+        'image_variants': product.get('image_variants') or {}
     }
 
 def normalize_product(producto):
@@ -45,84 +54,35 @@ def normalize_product(producto):
 @bp_empleado.route("/")
 @require_employee_or_admin
 def empleado_panel():
-    productos_collection = db["products"]
-    orders_collection = db["orders"]
-    users_collection = db["users"]
-
     empleado_id = ObjectId(session.get("user_id"))
 
-    # ==================================================
-    # PEDIDOS CREADOS POR EL EMPLEADO
-    # ==================================================
-    pedidos_creados_db = list(orders_collection.find({
-        "created_by": empleado_id
-    }))
-
-    pedidos_creados = []
-    for p in pedidos_creados_db:
-        # buscar cliente si existe
-        cliente = None
-        if p.get("customer_id"):
-            cliente = users_collection.find_one({"_id": ObjectId(p["customer_id"])})
+    # Una sola agregación: últimos pedidos creados/asignados, conteos y stock bajo
+    panel = get_employee_panel(empleado_id, limit=PEDIDOS_PANEL)
 
+    def formatear(p):
         fecha = p.get("date", datetime.utcnow())
         if isinstance(fecha, datetime):
             fecha = fecha.strftime("%Y-%m-%d %H:%M")
-
-        pedidos_creados.append({
+        return {
             "id": str(p["_id"]),
-            "cliente": cliente.get("username") if cliente else "Cliente",
+            "cliente": p.get("cliente") or "Cliente",
             "total": p.get("total", 0),
             "estado": p.get("status", "pendiente"),
             "fecha": fecha
-        })
-
-    # ==================================================
-    # PEDIDOS ACEPTADOS POR EL EMPLEADO
-    # ==================================================
-    pedidos_asignados_db = list(orders_collection.find({
-        "employee_id": empleado_id
-    }))
-
-    pedidos_asignados = []
-    for p in pedidos_asignados_db:
-        cliente = None
-        if p.get("customer_id"):
-            cliente = users_collection.find_one({"_id": ObjectId(p["customer_id"])})
-
-        fecha = p.get("date", datetime.utcnow())
-        if isinstance(fecha, datetime):
-            fecha = fecha.strftime("%Y-%m-%d %H:%M")
-
-        pedidos_asignados.append({
-            "id": str(p["_id"]),
-            "cliente": cliente.get("username") if cliente else "Cliente",
-            "total": p.get("total", 0),
-            "estado": p.get("status", "pendiente"),
-            "fecha": fecha
-        })
-
-    # ==================================================
-    # DATOS GENERALES DEL DASHBOARD
-    # ==================================================
-    pedidos_pendientes = orders_collection.count_documents({"status": "pendiente"})
-
-    hoy_inicio = datetime(datetime.today().year, datetime.today().month, datetime.today().day)
-    pedidos_hoy = orders_collection.count_documents({"date": {"$gte": hoy_inicio}})
-
-    stock_bajo = productos_collection.count_documents({"quantity": {"$lt": 5}})
-    productos_bajo_stock = list(productos_collection.find({"quantity": {"$lt": 5}}))
+        }
 
-    clientes_hoy = users_collection.count_documents({"role": "cliente"})
+    pedidos_creados = [formatear(p) for p in panel["creados"]]
+    pedidos_asignados = [formatear(p) for p in panel["asignados"]]
+    productos_bajo_stock = panel["stock_bajo"]
 
     return render_template(
         "empleado/dashboard.html",
         pedidos_creados=pedidos_creados,
         pedidos_asignados=pedidos_asignados,
-        pedidos_pendientes=pedidos_pendientes,
-        pedidos_hoy=pedidos_hoy,
-        stock_bajo=stock_bajo,
-        clientes_hoy=clientes_hoy,
+        pedidos_pendientes=panel["pendientes"],
+        pedidos_hoy=panel["hoy"],
+        stock_bajo=len(productos_bajo_stock),
+        clientes_hoy=panel["clientes"],
         productos_bajo_stock=productos_bajo_stock,
         rol="empleado"
     )
@@ -133,8 +93,12 @@ def empleado_panel():
 @bp_empleado.route("/clientes")
 @require_employee_or_admin
 def empleado_clientes():
-    users_collection = db["users"]
-    clientes_db = list(users_collection.find({"role": "cliente"}))
+    # Una página del directorio (keyset por nombre) con búsqueda por prefijo
+    q = request.args.get("q", "").strip()
+    clientes_db, siguiente = get_user_directory(
+        "cliente", q=q, after=request.args.get("despues"), limit=CLIENTES_POR_PAGINA
+    )
+    total, total_exacto = count_user_directory("cliente", q)
     clientes = []
     for c in clientes_db:
         clientes.append({
@@ -147,8 +111,35 @@ def empleado_clientes():
     return render_template(
         "empleado/empleado_clientes.html",
         clientes=clientes,
+        q=q,
+        siguiente=siguiente,
+        total=total,
+        total_exacto=total_exacto,
         rol="empleado"
     )
+
+# ============================================================
+#              BUSCAR CLIENTES (JSON)
+# ============================================================
+@bp_empleado.route("/clientes/buscar")
+@require_employee_or_admin
+def empleado_buscar_clientes():
+    """Autocompletado de clientes por prefijo de nombre o correo, paginado con ?despues=."""
+    q = request.args.get("q", "").strip()
+    if not q:
+        return jsonify({"clientes": [], "siguiente": None})
+    clientes_db, siguiente = get_user_directory(
+        "cliente", q=q, after=request.args.get("despues"),
+        limit=SUGERENCIAS_CLIENTES, projection={"username": 1, "email": 1}
+    )
+    return jsonify({
+        "clientes": [{
+            "id": str(c["_id"]),
+            "username": c.get("username"),
+            "email": c.get("email")
+        } for c in clientes_db],
+        "siguiente": siguiente
+    })
 # ============================================================
 #              CREAR CLIENTE DESDE EMPLEADO
 # ============================================================
@@ -188,6 +179,7 @@ def empleado_crear_cliente():
 
     # Insertar en Mongo
     users_collection.insert_one(nuevo_cliente.to_dict())
+    invalidate_user_directory()
 
     return {"ok": True, "msg": "Cliente creado correctamente"}
 
@@ -215,6 +207,8 @@ def empleado_editar_cliente(cliente_id):
     users_collection = db["users"]
    
     result = users_collection.update_one({"_id": ObjectId(cliente_id)}, {"$set": update_data})
+    invalidate_user_status(cliente_id)
+    invalidate_user_directory()
     if result.matched_count:
         return {"ok": True, "msg": "Cliente actualizado correctamente"}
     return {"ok": False, "msg": "Cliente no encontrado"}, 404
@@ -232,6 +226,8 @@ def empleado_eliminar_cliente(cliente_id):
 
     # Opción 2: marcar como inactivo en vez de eliminar
     # result = users_collection.update_one({"_id": ObjectId(cliente_id)}, {"$set": {"is_active": False}})
+    invalidate_user_status(cliente_id)
+    invalidate_user_directory()
 
     if result.deleted_count:
         return {"ok": True, "msg": "Cliente eliminado correctamente"}
@@ -259,6 +255,7 @@ def empleado_crear_pedido():
 
             total = 0
             nuevos_detalles = []
+            ajustes = []
             detalles_viejos = order.get("details", [])
 
             for p in data["detalles"]:
@@ -272,9 +269,7 @@ def empleado_crear_pedido():
                 cantidad_vieja = int(viejo["quantity"]) if viejo else 0
 
                 diferencia = cantidad_vieja - cantidad_nueva  # >0 devuelve stock, <0 resta stock
-                ok, msg = verificar_y_ajustar_stock(product_id, diferencia)
-                if not ok:
-                    return {"ok": False, "msg": msg}, 400
+                ajustes.append((product_id, diferencia))
 
                 nuevos_detalles.append({
                     "product_id": ObjectId(product_id),
@@ -282,10 +277,17 @@ def empleado_crear_pedido():
                     "subtotal": subtotal
                 })
 
+            # Ajustar el stock de todas las líneas a la vez (todo o nada)
+            ok, resultados = ajustar_stock_lote(ajustes)
+            if not ok:
+                msg = next(r["msg"] for r in resultados if not r["ok"])
+                return {"ok": False, "msg": msg, "lineas": resultados}, 400
+
             db["orders"].update_one(
                 {"_id": ObjectId(order_id)},
                 {"$set": {"details": nuevos_detalles, "total": total}}
             )
+            record_order_change(order, {**order, "details": nuevos_detalles, "total": total})
             return {"ok": True, "msg": "Pedido actualizado correctamente"}, 200
 
         # -------------------------
@@ -308,11 +310,6 @@ def empleado_crear_pedido():
             subtotal = float(p["subtotal"])
             total += subtotal
 
-            # Reservar stock
-            ok, msg = verificar_y_ajustar_stock(product_id, -cantidad)
-            if not ok:
-                return {"ok": False, "msg": msg}, 400
-
             detalles_convertidos.append({
                 "product_id": ObjectId(product_id),
                 "quantity": cantidad,
@@ -326,6 +323,14 @@ def empleado_crear_pedido():
         except:
             return {"ok": False, "msg": "ID de cliente inválido"}, 400
 
+        # Reservar el stock de todas las líneas a la vez (todo o nada)
+        ok, resultados = ajustar_stock_lote(
+            [(d["product_id"], -d["quantity"]) for d in detalles_convertidos]
+        )
+        if not ok:
+            msg = next(r["msg"] for r in resultados if not r["ok"])
+            return {"ok": False, "msg": msg, "lineas": resultados}, 400
+
         order_obj = {
             "customer_id": customer_oid,
             "employee_id": None,
@@ -337,27 +342,24 @@ def empleado_crear_pedido():
         }
 
         db["orders"].insert_one(order_obj)
+        record_order_change(None, order_obj)
         return {"ok": True, "msg": "Pedido registrado correctamente"}, 200
 
     # -------------------------
     # GET → cargar formulario
     # -------------------------
     productos_db = list(db["products"].find({"status": "Disponible"}))
-    clientes_db = list(db["users"].find({"role": "cliente"}))
 
     productos = [{
         "id": str(p["_id"]),
         "name": p.get("name"),
         "price": p.get("price"),
         "description": p.get("description"),
-        "image": p.get("image")
+        "image": p.get("image"),
+        "image_variants": p.get("image_variants") or {}
     } for p in productos_db]
 
-    clientes = [{
-        "id": str(c["_id"]),
-        "username": c.get("username"),
-        "email": c.get("email")
-    } for c in clientes_db]
+    # Los clientes ya no se cargan aquí: el formulario los busca en /clientes/buscar
 
     # Detectar si venimos a editar
     order_id = request.args.get("id")
@@ -366,14 +368,20 @@ def empleado_crear_pedido():
     if order_id:
         order = db["orders"].find_one({"_id": ObjectId(order_id)})
         if order:
+            cliente = get_users_by_ids([order.get("customer_id")], {"username": 1}).get(str(order.get("customer_id")))
+            productos_map = get_products_by_ids(
+                (d["product_id"] for d in order.get("details", [])),
+                {"name": 1, "price": 1}
+            )
             pedido_editar = {
                 "id": str(order["_id"]),
                 "cliente_id": str(order["customer_id"]),
+                "cliente_nombre": cliente.get("username") if cliente else None,
                 "detalles": [
                     {
                         "id": str(d["product_id"]),
-                        "nombre": db["products"].find_one({"_id": d["product_id"]})["name"],
-                        "precio": db["products"].find_one({"_id": d["product_id"]})["price"],
+                        "nombre": productos_map.get(str(d["product_id"]), {}).get("name"),
+                        "precio": productos_map.get(str(d["product_id"]), {}).get("price"),
                         "cantidad": d["quantity"],
                         "subtotal": d["subtotal"]
                     }
@@ -384,7 +392,6 @@ def empleado_crear_pedido():
     return render_template(
         "empleado/crear_pedido.html",
         productos=productos,
-        clientes=clientes,
         rol="empleado",
         pedido=pedido_editar
     )
@@ -457,42 +464,55 @@ def empleado_inventario():
 @bp_empleado.route("/pedidos")
 @require_employee_or_admin
 def empleado_pedidos():
-    pedidos_db = list(db["orders"].find())
+    # Una página (keyset sobre date, _id) con los filtros de la URL
+    filtros = {
+        "estado": request.args.get("estado", ""),
+        "cliente": request.args.get("cliente", ""),
+        "empleado": request.args.get("empleado", "")
+    }
+    pedidos_db, siguiente, anterior = get_orders_page(
+        status=filtros["estado"] or None,
+        customer_id=filtros["cliente"] or None,
+        employee_id=filtros["empleado"] or None,
+        after=request.args.get("despues"),
+        before=request.args.get("antes"),
+        limit=PEDIDOS_POR_PAGINA
+    )
     pedidos = []
 
+    # Resolver los clientes de la página con una consulta $in
+    # (el detalle de productos se carga aparte en /pedidos/detalle)
+    filas = {p["_id"]: order_board_row(p) for p in pedidos_db}
+    clientes_map = get_users_by_ids(cliente_id for cliente_id, _, _ in filas.values())
+    usuario_actual = session.get("user_id")
+
     for p in pedidos_db:
+        cliente_id, estado, carrito = filas[p["_id"]]
         cliente_nombre = "Cliente no registrado"
-        if p.get("customer_id"):
-            cliente = db["users"].find_one({"_id": ObjectId(p["customer_id"])})
-            if cliente:
-                cliente_nombre = cliente.get("username", "Cliente")
+        cliente = clientes_map.get(str(cliente_id))
+        if cliente:
+            cliente_nombre = cliente.get("username", "Cliente")
 
         fecha = p.get("date", datetime.utcnow())
         if isinstance(fecha, datetime):
             fecha = fecha.strftime("%Y-%m-%d %H:%M")
 
-        detalles_con_nombre = []
-        for d in p.get("details", []):
-            prod = db["products"].find_one({"_id": ObjectId(d["product_id"])})
-            detalles_con_nombre.append({
-                "product_id": str(d["product_id"]),
-                "product_name": prod["name"] if prod else "Producto eliminado",
-                "quantity": d.get("quantity", 0),
-                "subtotal": d.get("subtotal", 0)
-            })
-
         pedidos.append({
             "id": str(p["_id"]),
             "cliente": cliente_nombre,
             "total": p.get("total", 0),
-            "estado": p.get("status", "pendiente"),
+            "estado": estado,
+            "carrito": carrito,
             "fecha": fecha,
-            "detalles": detalles_con_nombre
+            "creado_por_empleado": str(p.get("created_by")) == usuario_actual
         })
 
     return render_template(
         "empleado/pedidos.html",
         pedidos=pedidos,
+        filtros=filtros,
+        siguiente=siguiente,
+        anterior=anterior,
         rol="empleado"
     )
 
@@ -537,6 +557,7 @@ def empleado_aceptar_pedido(order_id):
         {"_id": ObjectId(order_id)},
         {"$set": {"status": "aceptado", "employee_id": ObjectId(session.get("user_id"))}}
     )
+    record_order_change(order, {**order, "status": "aceptado"})
 
     return jsonify({"ok": True, "new_status": "aceptado"})
 
@@ -555,6 +576,7 @@ def empleado_entregar_pedido(order_id):
         {"_id": ObjectId(order_id)},
         {"$set": {"status": "entregado"}}
     )
+    record_order_change(order, {**order, "status": "entregado"})
 
     return jsonify({"ok": True, "new_status": "entregado"})
 
@@ -576,5 +598,6 @@ def empleado_cancelar_pedido(order_id):
         {"_id": ObjectId(order_id)},
         {"$set": {"status": "cancelado"}}
     )
+    record_order_change(order, {**order, "status": "cancelado"})
 
     return jsonify({"ok": True, "new_status": "cancelado"})
@@ -1,4 +1,4 @@
-from database import dbConnection
+from database import get_db
 from entities.product import Product
 from entities.category import Category
 from entities.stock import Stock
@@ -7,9 +7,24 @@ from entities.order import Order
 from entities.orderDetail import OrderDetail
 from entities.stock import Stock
 from bson.objectid import ObjectId
-from datetime import datetime
+from pymongo import UpdateOne, ReturnDocument
+from indexes import ensure_collection_indexes, DIRECTORY_COLLATION
+from search import CatalogSearchIndex, fold
+from cache import TTLCache
+from images import hashed_filename, build_variants
+from assets import manifest_version
+from functools import wraps
+import base64
+import hashlib
+import json
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from flask import session, request, make_response
+from markupsafe import Markup
 from werkzeug.security import generate_password_hash
-db = dbConnection()
+from routes.auth import invalidate_user_status
+db = get_db()
 def normalize_product(producto):
     """
     Convierte un producto que puede tener atributos en español o inglés
@@ -25,13 +40,209 @@ def normalize_product(producto):
         "imagen": producto.get("imagen") or producto.get("image") or "cupcake.jpg"
     }
 
+def to_object_ids(ids):
+    """Convierte una lista de ids (str u ObjectId) a ObjectId únicos, ignorando los inválidos."""
+    result = []
+    vistos = set()
+    for i in ids:
+        if not i:
+            continue
+        try:
+            oid = i if isinstance(i, ObjectId) else ObjectId(i)
+        except Exception:
+            continue
+        if oid not in vistos:
+            vistos.add(oid)
+            result.append(oid)
+    return result
+
+def get_users_by_ids(user_ids, projection=None):
+    """Resuelve varios usuarios con una sola consulta $in. Devuelve {str(_id): usuario}."""
+    oids = to_object_ids(user_ids)
+    if not oids:
+        return {}
+    users = db['users'].find({'_id': {'$in': oids}}, projection or {'username': 1})
+    return {str(u['_id']): u for u in users}
+
+def get_products_by_ids(product_ids, projection=None):
+    """Resuelve varios productos con una sola consulta $in. Devuelve {str(_id): producto}."""
+    oids = to_object_ids(product_ids)
+    if not oids:
+        return {}
+    products = db['products'].find({'_id': {'$in': oids}}, projection or {'name': 1, 'price': 1})
+    return {str(p['_id']): p for p in products}
+
+# ================= CACHÉ DEL CATÁLOGO =================
+# El catálogo (productos disponibles y categorías) se guarda en memoria con
+# claves que incluyen la versión del catálogo. Cada escritura de admin llama a
+# bump_catalog_version(), que incrementa la versión en meta['catalog']; los
+# demás procesos la releen como mucho cada CATALOG_VERSION_CHECK segundos.
+catalog_cache = TTLCache(
+    maxsize=int(os.environ.get('CATALOG_CACHE_SIZE', 512)),
+    ttl=int(os.environ.get('CATALOG_CACHE_TTL', 600)),
+    name="catalog"
+)
+CATALOG_VERSION_CHECK = float(os.environ.get('CATALOG_VERSION_CHECK', 5))
+_catalog_version = {'version': None, 'updated_at': None, 'checked_at': 0.0}
+
+def _set_catalog_version(doc):
+    version = doc.get('version', 0) if doc else 0
+    if version != _catalog_version['version']:
+        catalog_search.invalidate()
+    _catalog_version['version'] = version
+    _catalog_version['updated_at'] = doc.get('updated_at') if doc else None
+    _catalog_version['checked_at'] = time.monotonic()
+
+def get_catalog_version():
+    if (_catalog_version['version'] is None
+            or time.monotonic() - _catalog_version['checked_at'] > CATALOG_VERSION_CHECK):
+        _set_catalog_version(db['meta'].find_one({'_id': 'catalog'}))
+    return _catalog_version['version']
+
+def get_catalog_updated_at():
+    """Fecha de la última modificación del catálogo (o None si nunca se modificó)."""
+    get_catalog_version()
+    return _catalog_version['updated_at']
+
+def bump_catalog_version():
+    """Llamar después de cualquier escritura en products o categories."""
+    doc = db['meta'].find_one_and_update(
+        {'_id': 'catalog'},
+        {'$inc': {'version': 1}, '$set': {'updated_at': datetime.utcnow()}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    _set_catalog_version(doc)
+
+def cached_catalog(name, loader, *args):
+    """Lee del caché del catálogo o llama a loader() y guarda el resultado."""
+    return catalog_cache.get_or_load((get_catalog_version(), name) + args, loader)
+
+def get_catalog_products():
+    """Productos disponibles. La lista es compartida: no modificarla."""
+    return cached_catalog('products', lambda: list(db['products'].find({'status': 'Disponible'})))
+
+def get_catalog_categories():
+    """Todas las categorías. La lista es compartida: no modificarla."""
+    return cached_catalog('categories', lambda: list(db['categories'].find()))
+
+def get_catalog_category_counts():
+    return cached_catalog('category_counts', lambda: get_category_counts('Disponible'))
+
+def get_catalog_product(product_id):
+    """Un producto por id (cualquier estado), o None si no existe."""
+    product_id = str(product_id)
+    return cached_catalog(
+        'product',
+        lambda: db['products'].find_one({'_id': ObjectId(product_id)}),
+        product_id
+    )
+
+def get_related_products(product, limit=3):
+    """Otros productos disponibles de la misma categoría, desde el caché."""
+    return [
+        p for p in get_catalog_products()
+        if p.get('category_id') == product.get('category_id') and p['_id'] != product['_id']
+    ][:limit]
+
+# ================= CACHÉ DE FRAGMENTOS =================
+# HTML ya renderizado de bloques de plantilla que solo dependen del catálogo
+# (grillas de productos, carruseles de categorías). La clave lleva la versión
+# del catálogo y el rol, así un bump_catalog_version() los invalida todos.
+# Memoria acotada: como mucho FRAGMENT_CACHE_SIZE fragmentos de hasta
+# FRAGMENT_MAX_CHARS caracteres cada uno (los más grandes se renderizan sin guardar).
+fragment_cache = TTLCache(
+    maxsize=int(os.environ.get('FRAGMENT_CACHE_SIZE', 256)),
+    ttl=int(os.environ.get('FRAGMENT_CACHE_TTL', 600)),
+    name="fragments"
+)
+FRAGMENT_MAX_CHARS = int(os.environ.get('FRAGMENT_MAX_CHARS', 256 * 1024))
+
+def cached_fragment(name, *key, cache=True, caller=None):
+    """
+    Global de plantilla para usar con {% call %}:
+        {% call cached_fragment('cliente/productos-grid') %}...{% endcall %}
+    El bloque solo debe usar datos del catálogo (nada propio del usuario).
+    """
+    if not cache:
+        return caller()
+    clave = (get_catalog_version(), session.get('role'), name) + key
+    html = fragment_cache.get(clave)
+    if html is None:
+        html = Markup(caller())
+        if len(html) <= FRAGMENT_MAX_CHARS:
+            fragment_cache.set(clave, html)
+    return html
+
+# ================= GET CONDICIONAL DEL CATÁLOGO =================
+# Las páginas del catálogo solo cambian con el catálogo, el usuario (la
+# barra lateral muestra su nombre) y los estáticos compilados, así que el
+# ETag se calcula con eso sin tocar la base de datos. Si el navegador manda
+# ese ETag en If-None-Match se responde 304 sin ejecutar la vista.
+# If-Modified-Since solo no basta (no distingue de qué usuario es la copia).
+CATALOG_CACHE_CONTROL = 'private, no-cache'
+
+def catalog_etag(*parts):
+    datos = (
+        get_catalog_version(), get_catalog_updated_at(), manifest_version(),
+        session.get('role'), session.get('user_id')
+    ) + parts
+    return hashlib.sha1(repr(datos).encode('utf-8')).hexdigest()[:24]
+
+def _matching_etag(etag):
+    """El ETag que el navegador ya tiene, o None. La compresión agrega
+    "-gzip"/"-br" al ETag de la respuesta comprimida."""
+    for tag in (etag, f"{etag}-gzip", f"{etag}-br"):
+        if request.if_none_match.contains_weak(tag):
+            return tag
+    return None
+
+def conditional_catalog_page(view):
+    """Decorador para vistas del catálogo: ETag/Last-Modified y 304 sin renderizar."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        etag = catalog_etag(request.endpoint, *sorted(kwargs.items()))
+        vigente = _matching_etag(etag) if request.method == 'GET' else None
+        if vigente:
+            response = make_response('', 304)
+            response.set_etag(vigente)
+            response.headers['Cache-Control'] = CATALOG_CACHE_CONTROL
+            response.vary.add('Accept-Encoding')
+            return response
+
+        response = make_response(view(*args, **kwargs))
+        if response.status_code == 200:
+            response.set_etag(etag)
+            response.last_modified = get_catalog_updated_at()
+            response.headers['Cache-Control'] = CATALOG_CACHE_CONTROL
+        return response
+    return wrapper
+
 # ================= CATEGORÍAS =================
-def get_all_categories(with_count=False):
+def get_category_counts(status=None):
+    """
+    Cantidad de productos por categoría con una sola agregación $group.
+    status='Disponible' cuenta solo los productos visibles para el cliente.
+    Devuelve {str(category_id): cantidad}; category_id puede estar guardado
+    como string o como ObjectId y ambos se suman en la misma clave.
+    """
+    pipeline = []
+    if status:
+        pipeline.append({'$match': {'status': status}})
+    pipeline.append({'$group': {'_id': '$category_id', 'cantidad': {'$sum': 1}}})
+    conteo = {}
+    for r in db['products'].aggregate(pipeline):
+        key = str(r['_id'])
+        conteo[key] = conteo.get(key, 0) + r['cantidad']
+    return conteo
+
+def get_all_categories(with_count=False, status=None):
     categories = list(db['categories'].find({}))  # <-- sin projection
+    conteo = get_category_counts(status) if with_count else {}
     for c in categories:
         c['_id'] = str(c['_id'])  # convierte ObjectId a string
         if with_count:
-            c['cantidad_productos'] = db['products'].count_documents({'category_id': c['_id']})
+            c['cantidad_productos'] = conteo.get(c['_id'], 0)
     return categories
 
 
@@ -45,21 +256,34 @@ def create_category(name, icon="default.png", description=""):
         return False, "Categoría ya existe"
     cat = Category(name, icon, description)
     db['categories'].insert_one(cat.to_dict())
+    bump_catalog_version()
     return True, "Categoría creada"
 
 def update_category(category_id, data):
     result = db['categories'].update_one({'_id': ObjectId(category_id)}, {'$set': data})
+    bump_catalog_version()
     if result.matched_count:
         return True, "Categoría actualizada"
     return False, "Categoría no encontrada"
 
 def delete_category(category_id):
     result = db['categories'].delete_one({'_id': ObjectId(category_id)})
+    bump_catalog_version()
     if result.deleted_count:
         return True, "Categoría eliminada"
     return False, "Categoría no encontrada"
 
 # ================= PRODUCTOS =================
+# Índice de búsqueda del catálogo del cliente (solo productos disponibles)
+catalog_search = CatalogSearchIndex(
+    loader=lambda: get_catalog_products(),
+    ttl=int(os.environ.get('CATALOG_SEARCH_TTL', 300))
+)
+
+def search_products(query, page=1, per_page=12):
+    """Búsqueda por relevancia, sin tildes y por prefijo. Devuelve (productos, total)."""
+    return catalog_search.search(query, page, per_page)
+
 def get_all_products(category=None):
     query = {}
     if category:
@@ -79,20 +303,68 @@ def create_product(name, description, category_id, price, status="available", qu
         return False, "Categoría no existe"
     prod = Product(name, description, category_id, price, status, quantity, image)
     db['products'].insert_one(prod.to_dict())
+    bump_catalog_version()
     return True, "Producto creado"
 
 def update_product(product_id, data):
     result = db['products'].update_one({'_id': ObjectId(product_id)}, {'$set': data})
+    bump_catalog_version()
     if result.matched_count:
         return True, "Producto actualizado"
     return False, "Producto no encontrado"
 
 def delete_product(product_id):
     result = db['products'].delete_one({'_id': ObjectId(product_id)})
+    bump_catalog_version()
     if result.deleted_count:
         return True, "Producto eliminado"
     return False, "Producto no encontrado"
 
+# ================= IMÁGENES =================
+def set_image_variants(collection, filename, variantes, field='image'):
+    """
+    Guarda las variantes WebP ya generadas en los documentos que usan esa
+    imagen (se llama desde el hilo de images.image_pipeline).
+    """
+    if not variantes:
+        return 0
+    result = db[collection].update_many(
+        {field: filename},
+        {'$set': {f'{field}_variants': variantes}}
+    )
+    if result.modified_count:
+        bump_catalog_version()
+    return result.modified_count
+
+def reprocess_stored_images(collection, folder, field='image'):
+    """
+    Renombra por contenido y genera las variantes de las imágenes ya
+    referenciadas en la colección. Devuelve (procesadas, faltantes).
+    """
+    procesadas, faltantes = 0, []
+    for filename in db[collection].distinct(field):
+        if not filename:
+            continue
+        path = os.path.join(folder, filename)
+        if not os.path.isfile(path):
+            faltantes.append(filename)
+            continue
+        with open(path, 'rb') as f:
+            data = f.read()
+        nuevo = hashed_filename(filename, data)
+        if nuevo != filename and not os.path.exists(os.path.join(folder, nuevo)):
+            with open(os.path.join(folder, nuevo), 'wb') as f:
+                f.write(data)
+        cambios = {field: nuevo}
+        variantes = build_variants(folder, nuevo)
+        if variantes:
+            cambios[f'{field}_variants'] = variantes
+        db[collection].update_many({field: filename}, {'$set': cambios})
+        procesadas += 1
+    if procesadas:
+        bump_catalog_version()
+    return procesadas, faltantes
+
 # ================= STOCK =================
 def get_all_stock():
     # Devuelve los productos con su stock actual
@@ -133,28 +405,106 @@ def delete_stock(product_id):
         return True, "Stock eliminado"
     return False, "Producto no encontrado"
 
+def ajustar_stock_lote(ajustes):
+    """
+    Ajusta el stock de varios productos en un solo bulk_write, todo o nada.
+    ajustes: lista de (product_id, cantidad) con la misma convención que
+    verificar_y_ajustar_stock (cantidad < 0 resta, cantidad > 0 suma).
+
+    Antes de escribir, una consulta $in comprueba que los productos existan
+    y tengan stock. Cada resta lleva además la condición current_quantity >=
+    cantidad en el filtro, así dos compras simultáneas no pueden dejar el
+    stock en negativo, y marca el producto con el id de la operación
+    (inventory.last_op): si otra compra se adelantó entre la consulta y la
+    escritura, la marca indica qué líneas se aplicaron para revertirlas.
+
+    Devuelve (ok, resultados), con un resultado por línea:
+    {"product_id", "cantidad", "ok", "msg"}.
+    """
+    resultados = []
+    totales = {}
+    for product_id, cantidad in ajustes:
+        resultado = {"product_id": str(product_id), "cantidad": cantidad,
+                     "ok": True, "msg": "Stock ajustado correctamente"}
+        resultados.append(resultado)
+        oids = to_object_ids([product_id])
+        if not oids:
+            resultado.update(ok=False, msg="ID de producto inválido")
+            continue
+        totales[oids[0]] = totales.get(oids[0], 0) + cantidad
+
+    if not all(r["ok"] for r in resultados):
+        return False, resultados
+
+    productos = [oid for oid, cantidad in totales.items() if cantidad != 0]
+    if not productos:
+        return True, resultados
+
+    def stock_actual(p):
+        return p.get("inventory", {}).get("current_quantity", 0)
+
+    existentes = {
+        p["_id"]: stock_actual(p)
+        for p in db["products"].find({"_id": {"$in": productos}}, {"inventory.current_quantity": 1})
+    }
+    fallidos = {}
+    for oid in productos:
+        if oid not in existentes:
+            fallidos[oid] = "Producto no encontrado"
+        elif existentes[oid] + totales[oid] < 0:
+            fallidos[oid] = f"Stock insuficiente: solo quedan {existentes[oid]}"
+
+    if not fallidos:
+        token = ObjectId()
+        ops = []
+        for oid in productos:
+            filtro = {"_id": oid}
+            if totales[oid] < 0:
+                filtro["inventory.current_quantity"] = {"$gte": -totales[oid]}
+            ops.append(UpdateOne(filtro, {
+                "$inc": {"inventory.current_quantity": totales[oid]},
+                "$set": {"inventory.last_op": token}
+            }))
+        result = db["products"].bulk_write(ops, ordered=False)
+        if result.matched_count == len(ops):
+            return True, resultados
+
+        # Otra compra se adelantó: revertir las líneas que sí se aplicaron (si
+        # en ese instante un tercer ajuste ya cambió la marca de un producto,
+        # esa línea no se revierte)
+        aplicados = {
+            p["_id"] for p in db["products"].find(
+                {"_id": {"$in": productos}, "inventory.last_op": token}, {"_id": 1}
+            )
+        }
+        revertir = [
+            UpdateOne({"_id": oid}, {"$inc": {"inventory.current_quantity": -totales[oid]}})
+            for oid in aplicados
+        ]
+        if revertir:
+            db["products"].bulk_write(revertir, ordered=False)
+        sin_stock = [oid for oid in productos if oid not in aplicados]
+        for p in db["products"].find({"_id": {"$in": sin_stock}}, {"inventory.current_quantity": 1}):
+            fallidos[p["_id"]] = f"Stock insuficiente: solo quedan {stock_actual(p)}"
+        for oid in sin_stock:
+            fallidos.setdefault(oid, "Producto no encontrado")
+
+    for resultado in resultados:
+        oid = ObjectId(resultado["product_id"])
+        if oid in fallidos:
+            resultado.update(ok=False, msg=fallidos[oid])
+        else:
+            resultado["msg"] = "Revertido: otra línea no se pudo ajustar"
+    return False, resultados
+
 def verificar_y_ajustar_stock(product_id, cantidad):
     """
     Ajusta el stock de un producto.
     - cantidad < 0: venta/resta
     - cantidad > 0: reabastecer/sumar
     """
-    product = db["products"].find_one({"_id": ObjectId(product_id)})
-    if not product:
-        return False, "Producto no encontrado"
-
-    stock_actual = product.get("inventory", {}).get("current_quantity", 0)
-
-    if cantidad < 0:
-        if stock_actual + cantidad < 0:
-            return False, f"Stock insuficiente: solo quedan {stock_actual}"
-
-    # Ajustar stock
-    db["products"].update_one(
-        {"_id": ObjectId(product_id)},
-        {"$inc": {"inventory.current_quantity": cantidad}}
-    )
-    return True, "Stock ajustado correctamente"
+    ok, resultados = ajustar_stock_lote([(product_id, cantidad)])
+    return ok, resultados[0]["msg"]
 
 # ================= USUARIOS =================
 def get_all_users():
@@ -170,23 +520,246 @@ def create_user(username, email, password, role="cliente"):
         return False, "Usuario ya existe"
     user = User(username, email, password, role)
     db['users'].insert_one(user.to_dict())
+    invalidate_user_directory()
     return True, "Usuario creado"
 
 def update_user(user_id, data):
     if 'password' in data:
         data['password_hash'] = generate_password_hash(data.pop('password'))
     result = db['users'].update_one({'_id': ObjectId(user_id)}, {'$set': data})
+    invalidate_user_status(user_id)
+    invalidate_user_directory()
     if result.matched_count:
         return True, "Usuario actualizado"
     return False, "Usuario no encontrado"
 
 def delete_user(user_id):
     result = db['users'].delete_one({'_id': ObjectId(user_id)})
+    invalidate_user_status(user_id)
+    invalidate_user_directory()
     if result.deleted_count:
         return True, "Usuario eliminado"
     return False, "Usuario no encontrado"
 
+# ================= DIRECTORIO DE USUARIOS =================
+# Campos que muestran los directorios; nunca incluyen password_hash
+DIRECTORY_PROJECTIONS = {
+    'cliente': {'username': 1, 'email': 1, 'telefono': 1, 'direccion': 1, 'phone': 1, 'address': 1},
+    'empleado': {'username': 1, 'email': 1, 'cargo': 1, 'position': 1},
+}
+
+# Los totales se cuentan una vez por (rol, búsqueda) y se guardan unos segundos;
+# las altas, ediciones y bajas desde el panel los invalidan. Los registros
+# públicos (auth.register) se reflejan al expirar el TTL.
+DIRECTORY_COUNT_LIMIT = int(os.environ.get('DIRECTORY_COUNT_LIMIT', 1000))
+directory_count_cache = TTLCache(
+    maxsize=int(os.environ.get('DIRECTORY_COUNT_CACHE_SIZE', 256)),
+    ttl=float(os.environ.get('DIRECTORY_COUNT_TTL', 60)),
+    name="directory_counts"
+)
+
+def invalidate_user_directory():
+    directory_count_cache.clear()
+
+def encode_user_cursor(user):
+    """Cursor opaco (base64 de [username, _id]) del último usuario de una página."""
+    raw = json.dumps([user.get('username'), str(user['_id'])])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_user_cursor(cursor):
+    """Devuelve (username, _id) o None si el cursor no es válido."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        username, oid = json.loads(raw)
+        return username, ObjectId(oid)
+    except Exception:
+        return None
+
+def _directory_query(role, q=None):
+    query = {'role': role}
+    q = (q or '').strip()
+    if q:
+        # Prefijo como rango [q, q + U+FFFF): con la colación del índice no
+        # distingue mayúsculas ni tildes y, a diferencia de $regex, usa el índice.
+        rango = {'$gte': q, '$lt': q + '\uffff'}
+        query['$or'] = [{'username': rango}, {'email': rango}]
+    return query
+
+def get_user_directory(role, q=None, after=None, limit=25, projection=None):
+    """
+    Página del directorio de un rol ordenada por (username, _id) con paginación
+    keyset. 'q' filtra por prefijo del nombre o del correo. Devuelve
+    (usuarios, cursor_siguiente o None).
+    """
+    filtros = [_directory_query(role, q)]
+    posicion = decode_user_cursor(after) if after else None
+    if posicion:
+        username, oid = posicion
+        if username is None:
+            # Los usuarios sin nombre van primero; después vienen todos los demás
+            filtros.append({'$or': [
+                {'username': None, '_id': {'$gt': oid}},
+                {'username': {'$type': 'string'}}
+            ]})
+        else:
+            filtros.append({'$or': [
+                {'username': {'$gt': username}},
+                {'username': username, '_id': {'$gt': oid}}
+            ]})
+
+    usuarios = list(
+        db['users'].find(
+            {'$and': filtros},
+            projection or DIRECTORY_PROJECTIONS.get(role, {'username': 1, 'email': 1}),
+            collation=DIRECTORY_COLLATION
+        )
+        .sort([('username', 1), ('_id', 1)])
+        .limit(limit + 1)
+    )
+    siguiente = encode_user_cursor(usuarios[limit - 1]) if len(usuarios) > limit else None
+    return usuarios[:limit], siguiente
+
+def count_user_directory(role, q=None):
+    """
+    Total del directorio para mostrar junto a la paginación. Se cuenta hasta
+    DIRECTORY_COUNT_LIMIT y se guarda en caché, así que pasar de página no
+    vuelve a contar. Devuelve (total, es_exacto).
+    """
+    clave = (role, fold((q or '').strip()))
+    total = directory_count_cache.get_or_load(
+        clave,
+        lambda: db['users'].count_documents(
+            _directory_query(role, q),
+            collation=DIRECTORY_COLLATION,
+            limit=DIRECTORY_COUNT_LIMIT + 1
+        )
+    )
+    if total > DIRECTORY_COUNT_LIMIT:
+        return DIRECTORY_COUNT_LIMIT, False
+    return total, True
+
 # ================= PEDIDOS =================
+# Campos que muestran los tableros de pedidos (admin y empleado)
+# user_id y estado: los pedidos del carrito guardan así el cliente y el estado
+ORDER_BOARD_PROJECTION = {
+    'customer_id': 1, 'user_id': 1, 'employee_id': 1, 'created_by': 1, 'status': 1,
+    'estado': 1, 'total': 1, 'date': 1, 'details.product_id': 1, 'details.quantity': 1
+}
+_EPOCH = datetime(1970, 1, 1)
+
+def encode_order_cursor(order):
+    """Cursor opaco '<ms desde epoch>_<_id>' del último pedido de una página."""
+    fecha = order.get('date')
+    ms = int((fecha - _EPOCH).total_seconds() * 1000) if isinstance(fecha, datetime) else 'null'
+    return f"{ms}_{order['_id']}"
+
+def decode_order_cursor(cursor):
+    """Devuelve (fecha, _id) o None si el cursor no es válido."""
+    try:
+        ms, oid = cursor.split('_', 1)
+        fecha = None if ms == 'null' else _EPOCH + timedelta(milliseconds=int(ms))
+        return fecha, ObjectId(oid)
+    except Exception:
+        return None
+
+def _order_keyset_query(base, fecha, oid, atras=False):
+    """
+    Pedidos a continuación de (fecha, oid) en el orden (date, _id) descendente,
+    o antes de él si atras=True. Es un $or en la raíz con el filtro repetido en
+    cada rama: así cada rama es un IXSCAN acotado de un índice (..., date, _id)
+    y Mongo las une con SORT_MERGE, sin ordenar en memoria.
+    """
+    if atras:
+        # Los más recientes que el cursor, del más cercano al más lejano
+        if fecha is None:
+            ramas = [{'date': {'$ne': None}}, {'date': None, '_id': {'$gt': oid}}]
+        else:
+            ramas = [{'date': {'$gt': fecha}}, {'date': fecha, '_id': {'$gt': oid}}]
+    elif fecha is None:
+        # Los pedidos sin fecha van al final; solo queda avanzar por _id
+        return {**base, 'date': None, '_id': {'$lt': oid}}
+    else:
+        ramas = [{'date': {'$lt': fecha}}, {'date': fecha, '_id': {'$lt': oid}}, {'date': None}]
+    return {'$or': [{**base, **rama} for rama in ramas]}
+
+def order_board_row(order):
+    """
+    Cliente (id), estado y origen de un pedido del tablero en cualquiera de
+    los dos esquemas: panel (customer_id, status) o carrito (user_id, estado).
+    """
+    carrito = 'status' not in order and 'estado' in order
+    estado = (order.get('status') or order.get('estado') or 'pendiente').lower()
+    return order.get('customer_id') or order.get('user_id'), estado, carrito
+
+def get_orders_page(status=None, customer_id=None, employee_id=None, created_by=None,
+                    after=None, before=None, limit=20, projection=None):
+    """
+    Página de pedidos ordenada por (date, _id) descendente con paginación keyset:
+    'after' es el cursor del último pedido de la página anterior y 'before' el
+    del primero de la siguiente (para volver atrás), así que cada página es una
+    sola consulta indexada sin skip(). Devuelve (pedidos, cursor_siguiente,
+    cursor_anterior), con None cuando no hay más en esa dirección.
+    """
+    base = {}
+    if status:
+        base['status'] = status
+    for campo, valor in (('customer_id', customer_id), ('employee_id', employee_id), ('created_by', created_by)):
+        if valor:
+            oids = to_object_ids([valor])
+            base[campo] = oids[0] if oids else valor
+
+    atras = bool(before) and not after
+    posicion = decode_order_cursor(before if atras else after) if (after or before) else None
+    if posicion:
+        query = _order_keyset_query(base, *posicion, atras=atras)
+    else:
+        query, atras = base, False
+
+    orden = 1 if atras else -1
+    pedidos = list(
+        db['orders'].find(query, projection or ORDER_BOARD_PROJECTION)
+        .sort([('date', orden), ('_id', orden)])
+        .limit(limit + 1)
+    )
+    hay_mas = len(pedidos) > limit
+    pedidos = pedidos[:limit]
+    if atras:
+        if not pedidos:
+            # No queda nada más reciente (p. ej. se borraron): primera página
+            return get_orders_page(status, customer_id, employee_id, created_by,
+                                   limit=limit, projection=projection)
+        pedidos.reverse()
+        siguiente = encode_order_cursor(pedidos[-1])
+        anterior = encode_order_cursor(pedidos[0]) if hay_mas else None
+    else:
+        siguiente = encode_order_cursor(pedidos[-1]) if hay_mas else None
+        anterior = encode_order_cursor(pedidos[0]) if posicion and pedidos else None
+    return pedidos, siguiente, anterior
+
+def backfill_order_dates(batch_size=1000):
+    """
+    Completa 'date' en los pedidos del carrito que solo tienen 'fecha'
+    ("YYYY-MM-DD HH:MM" en hora local), para que entren en el orden de los
+    tableros. Devuelve cuántos pedidos se actualizaron.
+    """
+    cursor = db['orders'].find(
+        {'date': None, 'fecha': {'$type': 'string'}}, {'fecha': 1}, batch_size=batch_size
+    )
+    total = 0
+    for lote in _in_batches(cursor, batch_size):
+        ops = []
+        for o in lote:
+            try:
+                local = datetime.strptime(o['fecha'][:16], "%Y-%m-%d %H:%M")
+            except ValueError:
+                continue
+            # Misma convención que el resto de pedidos: UTC sin zona
+            fecha = local.astimezone(timezone.utc).replace(tzinfo=None)
+            ops.append(UpdateOne({'_id': o['_id'], 'date': None}, {'$set': {'date': fecha}}))
+        if ops:
+            total += db['orders'].bulk_write(ops, ordered=False).modified_count
+    return total
+
 def get_all_orders():
     """Listar todos los pedidos"""
     orders = db['orders'].find()
@@ -248,7 +821,9 @@ def create_order(customer_data, details, employee_id=None, status="pendiente", c
         customer_id = result.inserted_id
 
     order = Order(customer_id, employee_id, status=status, total=total, details=order_details, created_in_person=created_in_person)
-    result = db['orders'].insert_one(order.to_dict())
+    order_doc = order.to_dict()
+    result = db['orders'].insert_one(order_doc)
+    record_order_change(None, order_doc)
     return str(result.inserted_id), "Pedido creado" if result.inserted_id else None, "Error al crear pedido"
 
 def update_order(order_id, user_role=None, user_id=None, data=None):
@@ -260,6 +835,7 @@ def update_order(order_id, user_role=None, user_id=None, data=None):
     order = get_order_by_id(order_id)
     if not order:
         return False, "Pedido no encontrado"
+    order_before = db['orders'].find_one({'_id': ObjectId(order_id)})
 
     # Validación de roles
     if user_role == "cliente":
@@ -281,11 +857,496 @@ def update_order(order_id, user_role=None, user_id=None, data=None):
     # Actualizar pedido
     result = db['orders'].update_one({'_id': ObjectId(order_id)}, {'$set': data})
     if result.matched_count:
+        record_order_change(order_before, {**order_before, **data})
         return True, "Pedido actualizado"
     return False, "Error al actualizar pedido"
 
 def delete_order(order_id):
-    result = db['orders'].delete_one({'_id': ObjectId(order_id)})
-    if result.deleted_count > 0:
+    order = db['orders'].find_one_and_delete({'_id': ObjectId(order_id)})
+    if order:
+        record_order_change(order, None)
         return True, "Pedido eliminado"
-    return False, "Pedido no encontrado"
\ No newline at end of file
+    return False, "Pedido no encontrado"
+
+# ================= PANEL DEL ADMINISTRADOR =================
+# Todo el panel sale de una agregación $facet por colección (los nombres de
+# los clientes con $lookup) y se guarda DASHBOARD_CACHE_TTL segundos con
+# carga single-flight: si varios admins recargan a la vez, solo uno consulta.
+dashboard_cache = TTLCache(
+    maxsize=8,
+    ttl=float(os.environ.get('DASHBOARD_CACHE_TTL', 5)),
+    name="dashboard"
+)
+STOCK_BAJO = 5
+
+def _facet_count(facet):
+    return facet[0]['n'] if facet else 0
+
+def _lookup_username(campo, como):
+    """Etapas que reemplazan el id de 'campo' por el username del usuario (o None)."""
+    return [
+        {'$lookup': {'from': 'users', 'localField': campo, 'foreignField': '_id', 'as': como}},
+        {'$addFields': {como: {'$arrayElemAt': [f'${como}.username', 0]}}},
+    ]
+
+def _load_admin_dashboard():
+    productos = next(db['products'].aggregate([
+        {'$project': {'name': 1, 'quantity': 1}},
+        {'$facet': {
+            'total': [{'$count': 'n'}],
+            'stock_bajo': [{'$match': {'quantity': {'$lt': STOCK_BAJO}}}, {'$count': 'n'}],
+            'populares': [{'$sort': {'quantity': -1}}, {'$limit': 5}],
+        }}
+    ]))
+    # Pendientes y clientes top salen de order_counters (índice kind_orders),
+    # que ya cuenta los pedidos del carrito por user_id; los últimos pedidos
+    # son los 5 primeros del índice date_id. Nada recorre toda la colección.
+    ultimos = list(
+        db['orders'].find({}, {'customer_id': 1, 'user_id': 1, 'status': 1, 'estado': 1, 'date': 1})
+        .sort([('date', -1), ('_id', -1)]).limit(5)
+    )
+    clientes = get_users_by_ids(_order_customer(p) for p in ultimos)
+
+    ultimos_pedidos = []
+    for p in ultimos:
+        fecha = p.get('date', datetime.utcnow())
+        if isinstance(fecha, datetime):
+            fecha = fecha.strftime("%Y-%m-%d %H:%M")
+        cliente = clientes.get(str(_order_customer(p)))
+        ultimos_pedidos.append({
+            'id': str(p['_id']),
+            'cliente': cliente.get('username', "Cliente") if cliente else "Cliente no registrado",
+            'fecha': fecha,
+            'estado': p.get('status') or p.get('estado') or 'pendiente'
+        })
+
+    return {
+        'total_productos': _facet_count(productos['total']),
+        'total_categorias': db['categories'].estimated_document_count(),
+        'total_usuarios': db['users'].estimated_document_count(),
+        'pedidos_pendientes': get_order_count_by_status('pendiente'),
+        'stock_bajo': _facet_count(productos['stock_bajo']),
+        'ultimos_pedidos': ultimos_pedidos,
+        'productos_populares': [
+            {'nombre': p.get('name'), 'cantidad': p.get('quantity', 0)} for p in productos['populares']
+        ],
+        'clientes_top': [
+            {'nombre': c['nombre'], 'total': c['compras']} for c in get_top_customers(5)
+        ],
+    }
+
+def get_admin_dashboard():
+    """Datos del panel del administrador (cacheados unos segundos)."""
+    return dashboard_cache.get_or_load('admin', _load_admin_dashboard, single_flight=True)
+
+# ================= PANEL DEL EMPLEADO =================
+# Una sola agregación con $unionWith (MongoDB 4.4+): cada rama usa su propio
+# índice (created_by_date_id, employee_date_id, status_date_id, date_id, quantity,
+# role_username) y las listas de pedidos se cortan en los últimos N, así el
+# costo no crece con el historial del empleado.
+PANEL_ORDER_FIELDS = {'customer_id': 1, 'total': 1, 'status': 1, 'date': 1}
+
+def _panel_branch(coll, pipeline, lista):
+    return {'$unionWith': {'coll': coll, 'pipeline': pipeline + [{'$addFields': {'_lista': lista}}]}}
+
+def _recent_orders(campo, empleado_id, limit):
+    return [
+        {'$match': {campo: empleado_id}},
+        {'$sort': {'date': -1}},
+        {'$limit': limit},
+        {'$project': PANEL_ORDER_FIELDS},
+    ] + _lookup_username('customer_id', 'cliente')
+
+def get_employee_panel(empleado_id, limit=10, desde=None):
+    """
+    Datos del panel del empleado en una consulta: sus últimos pedidos creados
+    y asignados (con el nombre del cliente), los pedidos pendientes y los de
+    hoy (desde 'desde'), los productos con stock bajo y el total de clientes.
+    """
+    if desde is None:
+        hoy = datetime.today()
+        desde = datetime(hoy.year, hoy.month, hoy.day)
+    pipeline = _recent_orders('created_by', empleado_id, limit) + [
+        {'$addFields': {'_lista': 'creados'}},
+        _panel_branch('orders', _recent_orders('employee_id', empleado_id, limit), 'asignados'),
+        _panel_branch('orders', [{'$match': {'status': 'pendiente'}}, {'$count': 'n'}], 'pendientes'),
+        _panel_branch('orders', [{'$match': {'date': {'$gte': desde}}}, {'$count': 'n'}], 'hoy'),
+        _panel_branch('products', [
+            {'$match': {'quantity': {'$lt': STOCK_BAJO}}},
+            {'$project': {'name': 1, 'quantity': 1}},
+        ], 'stock_bajo'),
+        _panel_branch('users', [{'$match': {'role': 'cliente'}}, {'$count': 'n'}], 'clientes'),
+    ]
+    panel = {'creados': [], 'asignados': [], 'stock_bajo': [], 'pendientes': 0, 'hoy': 0, 'clientes': 0}
+    for doc in db['orders'].aggregate(pipeline):
+        lista = doc.pop('_lista')
+        if isinstance(panel[lista], list):
+            panel[lista].append(doc)
+        else:
+            panel[lista] = doc['n']
+    return panel
+
+# ================= ROLLUP DE VENTAS DIARIAS =================
+# Colección sales_daily: un documento por (día, producto, canal) con
+# unidades, ingresos y cantidad de pedidos, más una fila por (día, canal)
+# con product_id=None que guarda los totales de esos pedidos. Se mantiene de forma
+# incremental cada vez que se crea, edita, cancela o elimina un pedido,
+# y se puede reconstruir desde cero con rebuild_sales_daily().
+# order_counters lleva, con el mismo mecanismo, cuántos pedidos hay por estado
+# ({'kind': 'status', 'key': 'pagado'}) y por cliente ({'kind': 'customer',
+# 'key': <id>}), así los reportes no recorren la colección orders.
+SALES_DAILY = 'sales_daily'
+ORDER_COUNTERS = 'order_counters'
+
+def _order_day(order):
+    fecha = order.get('date') or order.get('fecha')
+    if isinstance(fecha, str):
+        try:
+            fecha = datetime.strptime(fecha[:16], "%Y-%m-%d %H:%M")
+        except ValueError:
+            return None
+    if not isinstance(fecha, datetime):
+        return None
+    return datetime(fecha.year, fecha.month, fecha.day)
+
+def _order_channel(order):
+    if order.get('created_by') or order.get('created_in_person'):
+        return 'presencial'
+    return 'online'
+
+def _order_lines(order):
+    """Líneas (product_id, unidades, subtotal) de un pedido, en cualquiera de los dos esquemas."""
+    for d in order.get('details', []):
+        yield d.get('product_id'), d.get('quantity', 0), d.get('subtotal', 0)
+    # Pedidos creados desde el carrito del cliente
+    for d in order.get('productos', []):
+        yield d.get('product_id'), d.get('cantidad', 0), d.get('subtotal', 0)
+
+def _order_sales(order):
+    """Aporte de un pedido al rollup: {(día, producto, canal): [unidades, ingresos, pedidos]}."""
+    aporte = {}
+    if not order:
+        return aporte
+    estado = str(order.get('status') or order.get('estado') or '').lower()
+    day = _order_day(order)
+    if estado == 'cancelado' or day is None:
+        return aporte
+    channel = _order_channel(order)
+    # Fila de totales del pedido (product_id=None) para contar pedidos sin duplicarlos
+    total = aporte.setdefault((day, None, channel), [0, 0, 1])
+    for product_id, quantity, subtotal in _order_lines(order):
+        oids = to_object_ids([product_id])
+        if not oids:
+            continue
+        key = (day, oids[0], channel)
+        linea = aporte.setdefault(key, [0, 0, 1])
+        for fila in (linea, total):
+            fila[0] += quantity or 0
+            fila[1] += subtotal or 0
+    return aporte
+
+def _order_customer(order):
+    """Cliente del pedido: customer_id (panel) o user_id (carrito), como ObjectId."""
+    oids = to_object_ids([order.get('customer_id') or order.get('user_id')])
+    return oids[0] if oids else None
+
+def _order_counters(order):
+    """Aporte de un pedido a order_counters: {(kind, key): 1}."""
+    if not order:
+        return {}
+    estado = str(order.get('status') or order.get('estado') or '').lower()
+    return {('status', estado): 1, ('customer', _order_customer(order)): 1}
+
+def _record_counters_change(before, after):
+    antes = _order_counters(before)
+    despues = _order_counters(after)
+    ops = []
+    for key in set(antes) | set(despues):
+        delta = despues.get(key, 0) - antes.get(key, 0)
+        if delta:
+            kind, valor = key
+            ops.append(UpdateOne({'kind': kind, 'key': valor}, {'$inc': {'orders': delta}}, upsert=True))
+    if ops:
+        db[ORDER_COUNTERS].bulk_write(ops, ordered=False)
+
+def record_order_change(before, after):
+    """
+    Aplica al rollup y a order_counters la diferencia entre el pedido antes y
+    después del cambio. before=None para pedidos nuevos, after=None para
+    pedidos eliminados. Las actualizaciones de cada colección van en un solo
+    bulk_write.
+    """
+    _record_counters_change(before, after)
+    antes = _order_sales(before)
+    despues = _order_sales(after)
+    ops = []
+    for key in set(antes) | set(despues):
+        a = antes.get(key, [0, 0, 0])
+        d = despues.get(key, [0, 0, 0])
+        delta = [d[i] - a[i] for i in range(3)]
+        if not any(delta):
+            continue
+        day, product_id, channel = key
+        ops.append(UpdateOne(
+            {'day': day, 'product_id': product_id, 'channel': channel},
+            {'$inc': {'units': delta[0], 'revenue': delta[1], 'orders': delta[2]}},
+            upsert=True
+        ))
+    if ops:
+        db[SALES_DAILY].bulk_write(ops, ordered=False)
+    if antes and ops:
+        # Limpiar filas que quedaron sin pedidos (cancelaciones/ediciones)
+        db[SALES_DAILY].delete_many({'orders': {'$lte': 0}, 'day': {'$in': list({k[0] for k in antes})}})
+
+def _replace_collection(name, docs):
+    """Construye la colección en una temporal y la reemplaza de una vez."""
+    tmp = db[name + '_rebuild']
+    tmp.drop()
+    if docs:
+        tmp.insert_many(docs)
+        tmp.rename(name, dropTarget=True)
+    else:
+        db[name].delete_many({})
+    ensure_collection_indexes(name)
+
+def rebuild_sales_daily(batch_size=1000):
+    """Recalcula sales_daily y order_counters desde cero recorriendo todos los pedidos."""
+    totales = {}
+    contadores = {}
+    for order in db['orders'].find({}, batch_size=batch_size):
+        for key, valores in _order_sales(order).items():
+            acumulado = totales.setdefault(key, [0, 0, 0])
+            for i in range(3):
+                acumulado[i] += valores[i]
+        for key in _order_counters(order):
+            contadores[key] = contadores.get(key, 0) + 1
+
+    docs = [
+        {'day': day, 'product_id': product_id, 'channel': channel,
+         'units': v[0], 'revenue': v[1], 'orders': v[2]}
+        for (day, product_id, channel), v in totales.items()
+    ]
+    _replace_collection(SALES_DAILY, docs)
+    _replace_collection(ORDER_COUNTERS, [
+        {'kind': kind, 'key': key, 'orders': n} for (kind, key), n in contadores.items()
+    ])
+    return len(docs)
+
+def get_order_count_by_status(status):
+    """Pedidos con ese estado, desde order_counters."""
+    doc = db[ORDER_COUNTERS].find_one({'kind': 'status', 'key': status.lower()}, {'orders': 1})
+    return doc['orders'] if doc else 0
+
+def get_top_customers(limit=5):
+    """Clientes con más pedidos, desde order_counters: [{'nombre', 'compras'}]."""
+    top = list(
+        db[ORDER_COUNTERS].find({'kind': 'customer', 'orders': {'$gt': 0}}, {'key': 1, 'orders': 1})
+        .sort('orders', -1).limit(limit)
+    )
+    clientes = get_users_by_ids([t['key'] for t in top])
+    return [
+        {"nombre": clientes.get(str(t['key']), {}).get('username', 'Cliente'), "compras": t['orders']}
+        for t in top
+    ]
+
+def get_sales_totals(desde, hasta):
+    """Ingresos, unidades y pedidos del rollup entre dos fechas [desde, hasta)."""
+    pipeline = [
+        {'$match': {'day': {'$gte': desde, '$lt': hasta}, 'product_id': None}},
+        {'$group': {
+            '_id': None,
+            'revenue': {'$sum': '$revenue'},
+            'units': {'$sum': '$units'},
+            'orders': {'$sum': '$orders'}
+        }}
+    ]
+    result = list(db[SALES_DAILY].aggregate(pipeline))
+    if not result:
+        return {'revenue': 0, 'units': 0, 'orders': 0}
+    return {k: result[0][k] for k in ('revenue', 'units', 'orders')}
+
+def get_monthly_sales(year):
+    """
+    Ventas por mes de un año en una sola agregación sobre sales_daily.
+    Los ingresos salen de los subtotales guardados en cada línea, así que no
+    depende de que el producto siga existiendo. Devuelve 12 elementos (enero..diciembre).
+    """
+    pipeline = [
+        {'$match': {
+            'day': {'$gte': datetime(year, 1, 1), '$lt': datetime(year + 1, 1, 1)},
+            'product_id': None
+        }},
+        {'$group': {
+            '_id': {'year': {'$year': '$day'}, 'month': {'$month': '$day'}},
+            'total': {'$sum': '$revenue'}
+        }}
+    ]
+    totales = {r['_id']['month']: r['total'] for r in db[SALES_DAILY].aggregate(pipeline)}
+    return [
+        {"mes": datetime(year, m, 1).strftime("%B"), "total": totales.get(m, 0)}
+        for m in range(1, 13)
+    ]
+
+def get_top_products(limit=5, desde=None, hasta=None):
+    """Productos más vendidos (por unidades) según sales_daily."""
+    match = {'product_id': {'$ne': None}}
+    if desde or hasta:
+        match['day'] = {}
+        if desde:
+            match['day']['$gte'] = desde
+        if hasta:
+            match['day']['$lt'] = hasta
+    pipeline = [
+        {'$match': match},
+        {'$group': {'_id': '$product_id', 'total_vendido': {'$sum': '$units'}}},
+        {'$match': {'total_vendido': {'$gt': 0}}},
+        {'$sort': {'total_vendido': -1}},
+        {'$limit': limit}
+    ]
+    top = list(db[SALES_DAILY].aggregate(pipeline))
+    productos = get_products_by_ids([t['_id'] for t in top], {'name': 1})
+    return [
+        {"nombre": productos.get(str(t['_id']), {}).get('name', 'Producto eliminado'),
+         "cantidad": t['total_vendido']}
+        for t in top
+    ]
+
+
+# ================= EXPORTACIONES =================
+# Iteradores de filas para exports.stream_export(). Recorren un cursor por
+# lotes de EXPORT_BATCH_SIZE y resuelven nombres con un $in por lote, así que
+# nunca tienen en memoria más de un lote.
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+
+ORDER_EXPORT_FIELDS = ['order_id', 'date', 'status', 'channel', 'customer_id', 'customer',
+                       'employee_id', 'items', 'total']
+ORDER_LINE_EXPORT_FIELDS = ['order_id', 'date', 'status', 'channel', 'product_id', 'product',
+                            'quantity', 'subtotal']
+SALES_EXPORT_FIELDS = ['day', 'channel', 'product_id', 'product', 'units', 'revenue', 'orders']
+STOCK_EXPORT_FIELDS = ['product_id', 'name', 'category', 'status', 'price', 'stock']
+
+_ORDER_EXPORT_PROJECTION = {
+    'date': 1, 'fecha': 1, 'status': 1, 'estado': 1, 'customer_id': 1, 'user_id': 1,
+    'employee_id': 1, 'created_by': 1, 'created_in_person': 1, 'total': 1,
+    'details': 1, 'productos': 1
+}
+
+def _in_batches(cursor, size):
+    lote = []
+    for doc in cursor:
+        lote.append(doc)
+        if len(lote) >= size:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+def _orders_range_query(desde=None, hasta=None):
+    """
+    Pedidos en [desde, hasta). Los del panel guardan 'date' y los del carrito
+    'fecha' como texto "YYYY-MM-DD HH:MM", que se compara como cadena.
+    """
+    if not desde and not hasta:
+        return {}
+    rango_date, rango_fecha = {}, {}
+    if desde:
+        rango_date['$gte'] = desde
+        rango_fecha['$gte'] = desde.strftime("%Y-%m-%d")
+    if hasta:
+        rango_date['$lt'] = hasta
+        rango_fecha['$lt'] = hasta.strftime("%Y-%m-%d")
+    return {'$or': [{'date': rango_date}, {'fecha': rango_fecha}]}
+
+def _orders_cursor(desde, hasta, batch_size):
+    return db['orders'].find(
+        _orders_range_query(desde, hasta), _ORDER_EXPORT_PROJECTION, batch_size=batch_size
+    )
+
+def iter_orders_export(desde=None, hasta=None, batch_size=EXPORT_BATCH_SIZE):
+    """Una fila por pedido en [desde, hasta)."""
+    for lote in _in_batches(_orders_cursor(desde, hasta, batch_size), batch_size):
+        clientes = get_users_by_ids(o.get('customer_id') or o.get('user_id') for o in lote)
+        for o in lote:
+            cliente_id = o.get('customer_id') or o.get('user_id')
+            lineas = list(_order_lines(o))
+            total = o.get('total')
+            if total is None:
+                total = sum(subtotal or 0 for _, _, subtotal in lineas)
+            yield {
+                'order_id': o['_id'],
+                'date': o.get('date') or o.get('fecha'),
+                'status': o.get('status') or o.get('estado'),
+                'channel': _order_channel(o),
+                'customer_id': cliente_id,
+                'customer': clientes.get(str(cliente_id), {}).get('username'),
+                'employee_id': o.get('employee_id'),
+                'items': sum(cantidad or 0 for _, cantidad, _ in lineas),
+                'total': total
+            }
+
+def iter_order_lines_export(desde=None, hasta=None, batch_size=EXPORT_BATCH_SIZE):
+    """Una fila por línea de pedido en [desde, hasta), en cualquiera de los dos esquemas."""
+    for lote in _in_batches(_orders_cursor(desde, hasta, batch_size), batch_size):
+        productos = get_products_by_ids(
+            product_id for o in lote for product_id, _, _ in _order_lines(o)
+        )
+        for o in lote:
+            base = {
+                'order_id': o['_id'],
+                'date': o.get('date') or o.get('fecha'),
+                'status': o.get('status') or o.get('estado'),
+                'channel': _order_channel(o)
+            }
+            for product_id, cantidad, subtotal in _order_lines(o):
+                yield {
+                    **base,
+                    'product_id': product_id,
+                    'product': productos.get(str(product_id), {}).get('name'),
+                    'quantity': cantidad,
+                    'subtotal': subtotal
+                }
+
+def iter_sales_daily_export(desde=None, hasta=None, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Filas de sales_daily en [desde, hasta), en el orden del índice único
+    (día, producto, canal). Las filas sin product_id son los totales por día y canal.
+    """
+    query = {}
+    if desde or hasta:
+        query['day'] = {}
+        if desde:
+            query['day']['$gte'] = desde
+        if hasta:
+            query['day']['$lt'] = hasta
+    cursor = (
+        db[SALES_DAILY].find(query, {'_id': 0}, batch_size=batch_size)
+        .sort([('day', 1), ('product_id', 1), ('channel', 1)])
+    )
+    for lote in _in_batches(cursor, batch_size):
+        productos = get_products_by_ids(r.get('product_id') for r in lote if r.get('product_id'))
+        for r in lote:
+            product_id = r.get('product_id')
+            yield {
+                **r,
+                'product': productos.get(str(product_id), {}).get('name') if product_id else 'TOTAL'
+            }
+
+def iter_stock_export(batch_size=EXPORT_BATCH_SIZE):
+    """Existencias actuales de todos los productos."""
+    categorias = {str(c['_id']): c.get('name') for c in db['categories'].find({}, {'name': 1})}
+    cursor = db['products'].find(
+        {},
+        {'name': 1, 'category_id': 1, 'status': 1, 'price': 1,
+         'inventory.current_quantity': 1, 'quantity': 1},
+        batch_size=batch_size
+    )
+    for p in cursor:
+        stock = p.get('inventory', {}).get('current_quantity')
+        yield {
+            'product_id': p['_id'],
+            'name': p.get('name'),
+            'category': categorias.get(str(p.get('category_id'))),
+            'status': p.get('status'),
+            'price': p.get('price'),
+            'stock': stock if stock is not None else p.get('quantity', 0)
+        }
@@ -0,0 +1,117 @@
+from bisect import bisect_left
+import re
+import threading
+import time
+import unicodedata
+
+# ============================================================
+#          ÍNDICE INVERTIDO EN MEMORIA PARA EL CATÁLOGO
+# ============================================================
+# Búsqueda sin $regex: el texto se normaliza (minúsculas y sin tildes),
+# se tokeniza y se indexa por palabra. Las consultas aceptan prefijos
+# ("past" encuentra "pastel"), ordenan por relevancia y nunca interpretan
+# caracteres especiales de la búsqueda como expresión regular.
+
+_TOKEN_RE = re.compile(r"[a-z0-9ñ]+")
+
+# Peso de cada campo en la relevancia
+FIELD_WEIGHTS = {"name": 3.0, "description": 1.0}
+PREFIX_FACTOR = 0.5
+
+
+def fold(text):
+    """Minúsculas y sin tildes ("Pastél" -> "pastel"); conserva la ñ."""
+    text = str(text or "").lower().replace("ñ", "\0")
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return text.replace("\0", "ñ")
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(fold(text))
+
+
+class CatalogSearchIndex:
+    """
+    Índice invertido token -> {product_id: peso}. Se reconstruye con
+    loader() cuando se invalida o cuando pasa el TTL.
+    """
+
+    def __init__(self, loader, ttl=300):
+        self.loader = loader
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._postings = {}
+        self._tokens = []
+        self._products = {}
+        self._built_at = None
+
+    def build(self, products):
+        postings = {}
+        docs = {}
+        for p in products:
+            pid = str(p["_id"])
+            docs[pid] = p
+            for field, weight in FIELD_WEIGHTS.items():
+                for token in tokenize(p.get(field)):
+                    scores = postings.setdefault(token, {})
+                    scores[pid] = scores.get(pid, 0) + weight
+        with self._lock:
+            self._postings = postings
+            self._tokens = sorted(postings)
+            self._products = docs
+            self._built_at = time.monotonic()
+
+    def invalidate(self):
+        with self._lock:
+            self._built_at = None
+
+    def _ensure_fresh(self):
+        built_at = self._built_at
+        if built_at is None or time.monotonic() - built_at > self.ttl:
+            self.build(self.loader())
+
+    def _match_token(self, term):
+        """Puntaje por producto para un término: coincidencia exacta o por prefijo."""
+        scores = dict(self._postings.get(term, {}))
+        i = bisect_left(self._tokens, term)
+        while i < len(self._tokens) and self._tokens[i].startswith(term):
+            token = self._tokens[i]
+            if token != term:
+                for pid, w in self._postings[token].items():
+                    scores[pid] = max(scores.get(pid, 0), w * PREFIX_FACTOR)
+            i += 1
+        return scores
+
+    def search(self, query, page=1, per_page=12):
+        """
+        Devuelve (productos_de_la_página, total). Todos los términos deben
+        coincidir; los resultados se ordenan por puntaje y luego por nombre.
+        """
+        self._ensure_fresh()
+        terms = tokenize(query)
+        if not terms:
+            return [], 0
+
+        with self._lock:
+            total_scores = None
+            for term in terms:
+                scores = self._match_token(term)
+                if total_scores is None:
+                    total_scores = scores
+                else:
+                    total_scores = {
+                        pid: total_scores[pid] + s
+                        for pid, s in scores.items() if pid in total_scores
+                    }
+                if not total_scores:
+                    return [], 0
+            products = self._products
+
+        ranked = sorted(
+            total_scores.items(),
+            key=lambda item: (-item[1], fold(products[item[0]].get("name")))
+        )
+        page = max(page, 1)
+        start = (page - 1) * per_page
+        return [products[pid] for pid, _ in ranked[start:start + per_page]], len(ranked)
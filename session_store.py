@@ -0,0 +1,274 @@
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+from bson.objectid import ObjectId
+from datetime import datetime
+from cache import TTLCache
+from database import get_db
+import os
+import secrets
+import threading
+import time
+
+# ============================================================
+#            SESIONES Y CARRITOS EN EL SERVIDOR
+# ============================================================
+# La cookie solo lleva un id de sesión opaco; los datos de la sesión y
+# el carrito viven en Mongo (colecciones sessions y carts) o, para
+# desarrollo, en memoria del proceso. STORE_BACKEND elige el backend.
+# Con Mongo, los documentos de sesión se guardan además unos segundos en
+# memoria del proceso (SESSION_CACHE_TTL, 0 lo desactiva): las peticiones
+# seguidas de un mismo usuario no vuelven a leer sessions. Lo que escribe
+# este proceso actualiza su copia al momento; un cambio hecho en otro worker
+# (logout, flash) tarda como mucho SESSION_CACHE_TTL en verse aquí. Las
+# peticiones a /static no abren sesión.
+SESSION_CACHE_TTL = float(os.environ.get("SESSION_CACHE_TTL", 5))
+SESSION_CACHE_SIZE = int(os.environ.get("SESSION_CACHE_SIZE", 10000))
+
+
+# ---------------------- SESIONES ----------------------
+class MongoSessionStore:
+    """Sesiones en la colección sessions; el índice TTL de expires_at borra las viejas."""
+
+    def __init__(self, collection="sessions", cache_ttl=SESSION_CACHE_TTL):
+        self.collection = collection
+        # sid -> (datos, expires_at); solo ahorra lecturas, Mongo sigue siendo la fuente
+        self._cache = None
+        if cache_ttl > 0:
+            self._cache = TTLCache(maxsize=SESSION_CACHE_SIZE, ttl=cache_ttl, name="sessions")
+
+    def _remember(self, sid, data, expires_at):
+        if self._cache is not None:
+            self._cache.set(sid, (dict(data), expires_at))
+
+    def load(self, sid):
+        ahora = datetime.utcnow()
+        cached = self._cache.get(sid) if self._cache is not None else None
+        if cached is not None and cached[1] > ahora:
+            return dict(cached[0])
+        doc = get_db()[self.collection].find_one({"_id": sid, "expires_at": {"$gt": ahora}})
+        if not doc:
+            return None
+        self._remember(sid, doc.get("data", {}), doc["expires_at"])
+        return doc.get("data", {})
+
+    def save(self, sid, data, lifetime):
+        expires_at = datetime.utcnow() + lifetime
+        get_db()[self.collection].update_one(
+            {"_id": sid},
+            {"$set": {"data": data, "expires_at": expires_at}},
+            upsert=True
+        )
+        self._remember(sid, data, expires_at)
+
+    def delete(self, sid):
+        if self._cache is not None:
+            self._cache.invalidate(sid)
+        get_db()[self.collection].delete_one({"_id": sid})
+
+
+class MemorySessionStore:
+    """
+    Sesiones en memoria del proceso (solo para desarrollo o un único worker).
+    Sin límite de tamaño, para no cerrar sesiones vivas bajo carga; las
+    vencidas se purgan al guardar, como mucho cada purge_every segundos.
+    """
+
+    def __init__(self, purge_every=60):
+        self._data = {}  # sid -> (expira_en, datos)
+        self._lock = threading.Lock()
+        self.purge_every = purge_every
+        self._purged_at = time.monotonic()
+
+    def load(self, sid):
+        with self._lock:
+            item = self._data.get(sid)
+            if item is None:
+                return None
+            if item[0] <= time.monotonic():
+                del self._data[sid]
+                return None
+            return dict(item[1])
+
+    def save(self, sid, data, lifetime):
+        ahora = time.monotonic()
+        with self._lock:
+            self._data[sid] = (ahora + lifetime.total_seconds(), dict(data))
+            if ahora - self._purged_at >= self.purge_every:
+                self._purged_at = ahora
+                for vencida in [k for k, (expira, _) in self._data.items() if expira <= ahora]:
+                    del self._data[vencida]
+
+    def delete(self, sid):
+        with self._lock:
+            self._data.pop(sid, None)
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.old_sid = None
+
+    def regenerate(self):
+        """
+        Cambia el id de la sesión conservando los datos (llamar al iniciar
+        sesión o registrarse, contra la fijación de sesión). El id anterior
+        se borra del almacén al guardar.
+        """
+        if not self.new and self.old_sid is None:
+            self.old_sid = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.modified = True
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Reemplaza la sesión firmada en cookie de Flask por una sesión en el servidor."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        # Los estáticos no usan la sesión: sin consulta al almacén ni cookie
+        if app.static_url_path and request.path.startswith(app.static_url_path + "/"):
+            return self.make_null_session(app)
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            data = self.store.load(sid)
+            if data is not None:
+                return ServerSession(data, sid=sid)
+        return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.old_sid:
+            self.store.delete(session.old_sid)
+
+        # Sesión vacía (p. ej. logout): borrar datos y cookie
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        lifetime = app.permanent_session_lifetime
+        if session.modified or session.new:
+            self.store.save(session.sid, dict(session), lifetime)
+        elif not self.should_set_cookie(app, session):
+            return
+
+        response.set_cookie(
+            name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+            domain=domain,
+            path=path
+        )
+
+
+# ---------------------- CARRITOS ----------------------
+# Representación compacta: {"items": {"<product_id>": cantidad}} por usuario.
+def _valid_product_id(product_id):
+    return ObjectId.is_valid(str(product_id))
+
+
+class MongoCartStore:
+    """Carritos en la colección carts; cada línea se actualiza con una sola escritura atómica."""
+
+    def __init__(self, collection="carts"):
+        self.collection = collection
+
+    def _carts(self):
+        return get_db()[self.collection]
+
+    def get(self, user_id):
+        doc = self._carts().find_one({"_id": str(user_id)}, {"items": 1})
+        return dict(doc.get("items", {})) if doc else {}
+
+    def add(self, user_id, product_id, cantidad=1):
+        if not _valid_product_id(product_id):
+            return
+        self._carts().update_one(
+            {"_id": str(user_id)},
+            {"$inc": {f"items.{product_id}": cantidad}, "$set": {"updated_at": datetime.utcnow()}},
+            upsert=True
+        )
+
+    def decrement(self, user_id, product_id):
+        """Resta 1; si la cantidad era 1 quita la línea."""
+        if not _valid_product_id(product_id):
+            return
+        campo = f"items.{product_id}"
+        result = self._carts().update_one(
+            {"_id": str(user_id), campo: {"$gt": 1}},
+            {"$inc": {campo: -1}, "$set": {"updated_at": datetime.utcnow()}}
+        )
+        if not result.matched_count:
+            self.remove(user_id, product_id)
+
+    def remove(self, user_id, product_id):
+        if not _valid_product_id(product_id):
+            return
+        self._carts().update_one(
+            {"_id": str(user_id)},
+            {"$unset": {f"items.{product_id}": ""}, "$set": {"updated_at": datetime.utcnow()}}
+        )
+
+    def clear(self, user_id):
+        self._carts().delete_one({"_id": str(user_id)})
+
+
+class MemoryCartStore:
+    """Carritos en memoria del proceso (solo para desarrollo o un único worker)."""
+
+    def __init__(self):
+        self._carts = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            return dict(self._carts.get(str(user_id), {}))
+
+    def add(self, user_id, product_id, cantidad=1):
+        if not _valid_product_id(product_id):
+            return
+        with self._lock:
+            items = self._carts.setdefault(str(user_id), {})
+            items[str(product_id)] = items.get(str(product_id), 0) + cantidad
+
+    def decrement(self, user_id, product_id):
+        with self._lock:
+            items = self._carts.get(str(user_id), {})
+            if items.get(str(product_id), 0) > 1:
+                items[str(product_id)] -= 1
+            else:
+                items.pop(str(product_id), None)
+
+    def remove(self, user_id, product_id):
+        with self._lock:
+            self._carts.get(str(user_id), {}).pop(str(product_id), None)
+
+    def clear(self, user_id):
+        with self._lock:
+            self._carts.pop(str(user_id), None)
+
+
+# ---------------------- FÁBRICA ----------------------
+def build_stores(backend="mongo"):
+    """Devuelve (session_interface, cart_store) para el backend elegido."""
+    if backend == "memory":
+        return ServerSideSessionInterface(MemorySessionStore()), MemoryCartStore()
+    return ServerSideSessionInterface(MongoSessionStore()), MongoCartStore()
+
+
+STORE_BACKEND = os.environ.get("STORE_BACKEND", "mongo")
+session_interface, cart_store = build_stores(STORE_BACKEND)
@@ -0,0 +1,95 @@
+import os
+import sys
+
+import mongomock
+import mongomock.collection
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("STORE_BACKEND", "memory")
+
+import database  # noqa: E402
+
+# ============================================================
+#          MONGO EN MEMORIA (mongomock) PARA LOS TESTS
+# ============================================================
+_client = mongomock.MongoClient()
+database.get_client = lambda: _client
+
+# pymongo 4.x pasa sort= a UpdateOne dentro de bulk_write; mongomock no lo admite
+_add_update = mongomock.collection.BulkOperationBuilder.add_update
+
+
+def _add_update_sin_sort(self, *args, sort=None, **kwargs):
+    return _add_update(self, *args, **kwargs)
+
+
+mongomock.collection.BulkOperationBuilder.add_update = _add_update_sin_sort
+
+# Lecturas que cuentan como una consulta al servidor
+QUERY_METHODS = ("find", "find_one", "aggregate", "count_documents", "distinct")
+
+
+class QueryCounter:
+    def __init__(self):
+        self.calls = []
+        self.depth = 0  # mongomock implementa find_one con find: solo cuenta la externa
+
+    def reset(self):
+        self.calls = []
+
+    def __len__(self):
+        return len(self.calls)
+
+
+@pytest.fixture
+def queries(monkeypatch):
+    """Registra (colección, método) de cada lectura hecha contra Mongo."""
+    contador = QueryCounter()
+    for nombre in QUERY_METHODS:
+        original = getattr(mongomock.collection.Collection, nombre)
+
+        def contado(self, *args, _original=original, _nombre=nombre, **kwargs):
+            if not contador.depth:
+                contador.calls.append((self.name, _nombre))
+            contador.depth += 1
+            try:
+                return _original(self, *args, **kwargs)
+            finally:
+                contador.depth -= 1
+
+        monkeypatch.setattr(mongomock.collection.Collection, nombre, contado)
+    return contador
+
+
+@pytest.fixture
+def db():
+    base = database.get_db()
+    for nombre in base.list_collection_names():
+        base.drop_collection(nombre)
+    return base
+
+
+@pytest.fixture
+def app(db):
+    from app import app as flask_app
+    flask_app.config.update(TESTING=True)
+    return flask_app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def login(client, db, role, username=None):
+    """Crea un usuario con ese rol y deja su sesión abierta en el cliente."""
+    user_id = db["users"].insert_one({
+        "username": username or role, "email": f"{username or role}@test.local",
+        "role": role, "is_active": True
+    }).inserted_id
+    with client.session_transaction() as sess:
+        sess["user_id"] = str(user_id)
+        sess["role"] = role
+        sess["username"] = username or role
+    return user_id
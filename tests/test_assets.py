@@ -0,0 +1,84 @@
+import os
+import re
+import shutil
+from urllib.parse import urlsplit
+
+import pytest
+from flask import render_template
+
+import assets
+
+# Imágenes que suben los usuarios: no forman parte del repositorio
+UPLOAD_DIRS = ("img/products/", "img/categories/")
+
+# Variables mínimas para que las plantillas que las exigen se rendericen
+CONTEXTO = {
+    "producto": {"id": "1", "nombre": "Tarta", "precio": 10, "descripcion": "", "imagen": "tarta.jpg"},
+    "stock_bajo": 0,
+    "pedidos_pendientes": 0,
+    "empleados": [],
+    "clientes": [],
+    "pedido": None,
+}
+
+_STATIC_URL_RE = re.compile(r'(?:href|src)="(/static/[^"]+)"|(/static/\S+) \d+w')
+
+
+def _static_refs(html):
+    for href, srcset in _STATIC_URL_RE.findall(html):
+        path = urlsplit(href or srcset).path[len("/static/"):]
+        if not path.startswith(UPLOAD_DIRS):
+            yield path
+
+
+def _plantillas(app):
+    return app.jinja_env.list_templates(extensions=["html"])
+
+
+@pytest.fixture
+def sin_manifiesto(monkeypatch):
+    monkeypatch.setattr(assets, "get_manifest", lambda: {})
+
+
+def test_bundles_solo_usan_hojas_existentes(app):
+    for bundle, hojas in assets.CSS_BUNDLES.items():
+        for src in hojas:
+            assert os.path.isfile(os.path.join(app.static_folder, src)), f"{bundle}: falta {src}"
+
+
+def test_plantillas_solo_referencian_estaticos_existentes(app, sin_manifiesto):
+    with app.test_request_context("/"):
+        for plantilla in _plantillas(app):
+            html = render_template(plantilla, **CONTEXTO)
+            for path in _static_refs(html):
+                assert os.path.isfile(os.path.join(app.static_folder, path)), \
+                    f"{plantilla}: no existe static/{path}"
+
+
+def test_plantillas_compiladas_referencian_archivos_de_dist(app, tmp_path, monkeypatch):
+    static = tmp_path / "static"
+    shutil.copytree(app.static_folder, static, ignore=shutil.ignore_patterns(assets.DIST_DIR))
+    monkeypatch.setattr(app, "static_folder", str(static))
+    assets.build_assets(str(static))
+    assets.reset_manifest()
+    try:
+        with app.test_request_context("/"):
+            for plantilla in _plantillas(app):
+                html = render_template(plantilla, **CONTEXTO)
+                for path in _static_refs(html):
+                    assert path.startswith(assets.DIST_DIR + "/"), f"{plantilla}: {path} sin compilar"
+                    assert os.path.isfile(static / path), f"{plantilla}: no existe static/{path}"
+    finally:
+        assets.reset_manifest()
+
+
+def test_css_links_en_debug_sirve_las_hojas_originales(app, monkeypatch):
+    bundle = "base"
+    manifest = {src: f"dist/{src}.0123456789ab" for src in assets.CSS_BUNDLES[bundle]}
+    manifest[assets.bundle_path(bundle)] = "dist/bundle.0123456789ab.css"
+    monkeypatch.setattr(assets, "get_manifest", lambda: manifest)
+    monkeypatch.setattr(assets, "ASSETS_DEBUG", True)
+
+    with app.test_request_context("/"):
+        html = assets.css_links(bundle)
+    assert list(_static_refs(html)) == list(assets.CSS_BUNDLES[bundle])
@@ -0,0 +1,14 @@
+import indexes
+
+
+def test_registro_duplicado_lo_rechaza_el_indice_unico(app, db, queries):
+    indexes.ensure_indexes()
+    datos = {"usuario": "ana", "correo": "ana@test.local", "password": "secreta"}
+
+    assert app.test_client().post("/register", data=datos).status_code == 302
+    queries.reset()
+    respuesta = app.test_client().post("/register", data={**datos, "usuario": "otra"})
+
+    assert "ya están registrados" in respuesta.get_data(as_text=True)
+    assert not [c for c in queries.calls if c[0] == "users"]  # sin consulta previa
+    assert db["users"].count_documents({}) == 1
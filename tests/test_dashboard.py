@@ -0,0 +1,26 @@
+from datetime import datetime, timedelta
+
+from routes import services
+
+
+def test_dashboard_cuenta_los_pedidos_del_carrito_por_cliente(db, queries):
+    ana = db["users"].insert_one({"username": "ana", "role": "cliente"}).inserted_id
+    luis = db["users"].insert_one({"username": "luis", "role": "cliente"}).inserted_id
+    inicio = datetime(2024, 1, 1)
+    pedidos = [
+        {"user_id": str(ana), "productos": [], "total": 5, "estado": "Pendiente",
+         "fecha": "2024-01-01 10:00", "date": inicio + timedelta(hours=i)}
+        for i in range(3)
+    ] + [{"customer_id": luis, "status": "pendiente", "total": 5, "date": inicio, "details": []}]
+    for pedido in pedidos:
+        db["orders"].insert_one(pedido)
+        services.record_order_change(None, pedido)
+    services.dashboard_cache.clear()
+
+    queries.reset()
+    datos = services.get_admin_dashboard()
+
+    assert datos["clientes_top"] == [{"nombre": "ana", "total": 3}, {"nombre": "luis", "total": 1}]
+    assert datos["pedidos_pendientes"] == 4
+    assert [p["cliente"] for p in datos["ultimos_pedidos"]][:1] == ["ana"]
+    assert ("orders", "aggregate") not in queries.calls
@@ -0,0 +1,135 @@
+import re
+from datetime import datetime, timedelta
+from html import unescape
+
+import pytest
+
+from conftest import login
+from routes import services
+
+TOTAL_PEDIDOS = 300
+POR_PAGINA = 25
+BOARDS = (("admin", "/admin/pedidos"), ("empleado", "/empleado/pedidos"))
+
+
+@pytest.fixture
+def pedidos(db):
+    """Muchos pedidos del panel (con 'date') y algunos del carrito antiguos (solo 'fecha')."""
+    clientes = [
+        db["users"].insert_one({"username": f"cliente{i}", "role": "cliente"}).inserted_id
+        for i in range(10)
+    ]
+    inicio = datetime(2024, 1, 1)
+    db["orders"].insert_many([
+        {"customer_id": clientes[i % 10], "status": "pendiente" if i % 2 else "aceptado",
+         "total": 10 + i, "date": inicio + timedelta(hours=i), "details": []}
+        for i in range(TOTAL_PEDIDOS)
+    ])
+    db["orders"].insert_many([
+        {"user_id": str(clientes[0]), "productos": [], "total": 5, "estado": "Pendiente",
+         "fecha": f"2023-12-{dia:02d} 09:00"}
+        for dia in range(1, 6)
+    ])
+    return clientes
+
+
+def _enlace(html, texto):
+    m = re.search(r'<a href="([^"]+)"[^>]*>' + re.escape(texto), html)
+    return unescape(m.group(1)) if m else None
+
+
+@pytest.mark.parametrize("role, url", BOARDS)
+def test_misma_cantidad_de_consultas_en_cualquier_pagina(client, db, pedidos, queries, role, url):
+    login(client, db, role)
+    assert client.get(url).status_code == 200  # calienta la caché de estado del usuario
+
+    queries.reset()
+    primera = client.get(url).get_data(as_text=True)
+    consultas_primera = list(queries.calls)
+
+    # Avanzar hasta una página intermedia siguiendo el cursor
+    html = primera
+    for _ in range(5):
+        html = client.get(_enlace(html, "Siguientes »")).get_data(as_text=True)
+    queries.reset()
+    client.get(_enlace(html, "Siguientes »"))
+
+    assert queries.calls == consultas_primera
+    assert len(consultas_primera) <= 3
+    assert [c for c in consultas_primera if c[0] == "orders"] == [("orders", "find")]
+
+
+def test_mas_recientes_vuelve_a_la_pagina_anterior(db, pedidos):
+    paginas = [services.get_orders_page(limit=POR_PAGINA)]
+    for _ in range(3):
+        paginas.append(services.get_orders_page(after=paginas[-1][1], limit=POR_PAGINA))
+
+    pedidos_p3, _, anterior = paginas[3]
+    atras, siguiente, anterior_p2 = services.get_orders_page(before=anterior, limit=POR_PAGINA)
+    assert [o["_id"] for o in atras] == [o["_id"] for o in paginas[2][0]]
+    assert siguiente == paginas[2][1]
+
+    atras, _, anterior_p1 = services.get_orders_page(before=anterior_p2, limit=POR_PAGINA)
+    assert [o["_id"] for o in atras] == [o["_id"] for o in paginas[1][0]]
+    atras, _, tope = services.get_orders_page(before=anterior_p1, limit=POR_PAGINA)
+    assert [o["_id"] for o in atras] == [o["_id"] for o in paginas[0][0]]
+    assert tope is None
+    assert paginas[0][2] is None
+
+
+def test_enlaces_de_paginacion_codifican_filtros(client, db, pedidos):
+    login(client, db, "admin")
+    filtros = {"estado": "pendiente", "cliente": "a b&c"}
+    html = client.get("/admin/pedidos", query_string=filtros).get_data(as_text=True)
+    assert "Más recientes" not in html
+
+    db["orders"].insert_many([
+        {"customer_id": "a b&c", "status": "pendiente", "total": 1,
+         "date": datetime(2024, 6, 1) + timedelta(minutes=i), "details": []}
+        for i in range(POR_PAGINA + 1)
+    ])
+    html = client.get("/admin/pedidos", query_string=filtros).get_data(as_text=True)
+    siguiente = _enlace(html, "Siguientes »")
+    assert "cliente=a+b%26c" in siguiente
+
+    html = client.get(siguiente).get_data(as_text=True)
+    anterior = _enlace(html, "« Más recientes")
+    assert "cliente=a+b%26c" in anterior and "antes=" in anterior
+    assert "Más recientes" not in client.get(anterior).get_data(as_text=True)
+
+
+def test_pedido_del_carrito_sale_en_la_primera_pagina(app, client, db, pedidos):
+    producto = db["products"].insert_one({
+        "name": "Tarta", "price": 20, "status": "Disponible",
+        "inventory": {"current_quantity": 10}
+    }).inserted_id
+    cliente = login(client, db, "cliente", "compradora")
+    client.post(f"/cliente/carrito/agregar/{producto}", data={"cantidad": 1})
+    client.post("/cliente/pagar")
+
+    nuevo = db["orders"].find_one({"user_id": str(cliente)})
+    assert isinstance(nuevo["date"], datetime)
+    assert services.get_orders_page(limit=POR_PAGINA)[0][0]["_id"] == nuevo["_id"]
+
+    # En el tablero: cliente y estado del esquema del carrito, sin acciones del panel
+    admin = app.test_client()
+    login(admin, db, "admin")
+    html = admin.get("/admin/pedidos").get_data(as_text=True)
+    fila = re.search(rf'<tr data-id="{nuevo["_id"]}">(.*?)</tr>', html, re.S).group(1)
+    assert "compradora" in fila and "pendiente" in fila
+    assert "aceptar" not in fila
+
+
+def test_backfill_da_fecha_a_los_pedidos_antiguos_del_carrito(db, pedidos):
+    assert services.backfill_order_dates() == 5
+    assert db["orders"].count_documents({"date": None}) == 0
+    assert services.backfill_order_dates() == 0
+
+    todos = []
+    pagina, siguiente, _ = services.get_orders_page(limit=POR_PAGINA)
+    todos += pagina
+    while siguiente:
+        pagina, siguiente, _ = services.get_orders_page(after=siguiente, limit=POR_PAGINA)
+        todos += pagina
+    assert len(todos) == TOTAL_PEDIDOS + 5
+    assert all(isinstance(o["date"], datetime) for o in todos)
@@ -0,0 +1,32 @@
+import os
+
+import pytest
+
+import database
+import indexes
+
+# explain() necesita un servidor real: sin MONGO_URI se omite
+pytestmark = pytest.mark.skipif(not os.environ.get("MONGO_URI"), reason="MONGO_URI no definida")
+
+
+@pytest.fixture(scope="module")
+def plan_db():
+    """Base de datos aparte con los índices de INDEXES; se borra al terminar."""
+    from pymongo import MongoClient
+    uri = os.environ["MONGO_URI"]
+    client = MongoClient(uri, **database._tls_options(uri))
+    nombre = f"{database.MONGO_DB_NAME}_plan_test"
+    client.drop_database(nombre)
+    db = client[nombre]
+    assert indexes.ensure_indexes(db) == []
+    yield db
+    client.drop_database(nombre)
+    client.close()
+
+
+@pytest.mark.parametrize("consulta", indexes.HOT_QUERIES, ids=[q[0] for q in indexes.HOT_QUERIES])
+def test_consulta_caliente_usa_indice(plan_db, consulta):
+    descripcion, collection, filtro, sort, *collation = consulta
+    etapas = indexes.explain_query(collection, filtro, sort, collation[0] if collation else None, plan_db)
+    assert "COLLSCAN" not in etapas, f"{descripcion}: {' > '.join(etapas)}"
+    assert "SORT" not in etapas, f"{descripcion} ordena en memoria: {' > '.join(etapas)}"
@@ -0,0 +1,56 @@
+from datetime import datetime, timedelta
+
+from session_store import MemorySessionStore, MongoSessionStore
+
+HORA = timedelta(hours=1)
+
+
+def test_sesion_mongo_se_lee_una_vez_y_sigue_a_las_escrituras(db, queries):
+    store = MongoSessionStore()
+    store.save("sid", {"user_id": "1"}, HORA)
+
+    queries.reset()
+    assert store.load("sid") == {"user_id": "1"}
+    assert store.load("sid") == {"user_id": "1"}
+    assert queries.calls == []  # save ya dejó la copia en memoria
+
+    store.save("sid", {"user_id": "1", "role": "admin"}, HORA)
+    assert store.load("sid") == {"user_id": "1", "role": "admin"}
+
+    store.delete("sid")
+    assert store.load("sid") is None
+    assert db["sessions"].count_documents({}) == 0
+
+
+def test_sesion_mongo_lee_de_la_base_si_no_esta_en_memoria(db, queries):
+    db["sessions"].insert_one({"_id": "sid", "data": {"a": 1}, "expires_at": datetime.utcnow() + HORA})
+    store = MongoSessionStore()
+
+    queries.reset()
+    assert store.load("sid") == {"a": 1}
+    assert store.load("sid") == {"a": 1}
+    assert queries.calls == [("sessions", "find_one")]
+
+
+def test_sesion_mongo_sin_cache(db, queries):
+    store = MongoSessionStore(cache_ttl=0)
+    store.save("sid", {"a": 1}, HORA)
+    queries.reset()
+    store.load("sid")
+    store.load("sid")
+    assert len(queries) == 2
+
+
+def test_sesiones_en_memoria_no_se_expulsan_bajo_carga():
+    store = MemorySessionStore()
+    for i in range(20000):
+        store.save(f"sid{i}", {"n": i}, HORA)
+    assert store.load("sid0") == {"n": 0}
+
+
+def test_sesiones_en_memoria_vencidas_se_purgan():
+    store = MemorySessionStore(purge_every=0)
+    store.save("vieja", {}, timedelta(seconds=-1))
+    store.save("nueva", {}, HORA)
+    assert "vieja" not in store._data
+    assert store.load("nueva") == {}
@@ -0,0 +1,55 @@
+import mongomock.collection
+from bson.objectid import ObjectId
+
+from routes import services
+
+
+def _producto(db, stock):
+    return db["products"].insert_one({"name": "Tarta", "inventory": {"current_quantity": stock}}).inserted_id
+
+
+def _stock(db, oid):
+    return db["products"].find_one({"_id": oid})["inventory"]["current_quantity"]
+
+
+def test_reserva_todas_las_lineas(db):
+    a, b = _producto(db, 5), _producto(db, 3)
+    ok, resultados = services.ajustar_stock_lote([(a, -2), (b, -3)])
+    assert ok and all(r["ok"] for r in resultados)
+    assert (_stock(db, a), _stock(db, b)) == (3, 0)
+
+
+def test_producto_desconocido_no_crea_documentos(db, queries):
+    a = _producto(db, 5)
+    queries.reset()
+    ok, resultados = services.ajustar_stock_lote([(a, -1), (ObjectId(), -1)])
+
+    assert queries.calls == [("products", "find")]  # solo la comprobación previa
+    assert not ok
+    assert [r["msg"] for r in resultados] == ["Revertido: otra línea no se pudo ajustar", "Producto no encontrado"]
+    assert db["products"].count_documents({}) == 1 and _stock(db, a) == 5
+
+
+def test_stock_insuficiente_no_escribe(db):
+    a, b = _producto(db, 5), _producto(db, 1)
+    ok, resultados = services.ajustar_stock_lote([(a, -1), (b, -2)])
+    assert not ok
+    assert resultados[1]["msg"] == "Stock insuficiente: solo quedan 1"
+    assert (_stock(db, a), _stock(db, b)) == (5, 1)
+
+
+def test_compra_simultanea_revierte_las_lineas_aplicadas(db, monkeypatch):
+    a, b = _producto(db, 5), _producto(db, 2)
+    original = mongomock.collection.Collection.bulk_write
+
+    def otra_compra_se_adelanta(self, ops, **kwargs):
+        monkeypatch.setattr(mongomock.collection.Collection, "bulk_write", original)
+        db["products"].update_one({"_id": b}, {"$inc": {"inventory.current_quantity": -2}})
+        return original(self, ops, **kwargs)
+
+    monkeypatch.setattr(mongomock.collection.Collection, "bulk_write", otra_compra_se_adelanta)
+    ok, resultados = services.ajustar_stock_lote([(a, -1), (b, -1)])
+
+    assert not ok
+    assert resultados[1]["msg"] == "Stock insuficiente: solo quedan 0"
+    assert (_stock(db, a), _stock(db, b)) == (5, 0)